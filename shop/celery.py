@@ -0,0 +1,22 @@
+import os
+from contextlib import contextmanager
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shop.settings')
+
+app = Celery('shop')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
+
+
+@contextmanager
+def eager_tasks():
+    """Run tasks in-process, e.g. for benchmarks and tests."""
+    # The settings loaded under the CELERY_ namespace shadow the plain
+    # option names, so app.conf.task_always_eager = True has no effect.
+    previous = app.conf.get('CELERY_TASK_ALWAYS_EAGER')
+    app.conf['CELERY_TASK_ALWAYS_EAGER'] = True
+    try:
+        yield
+    finally:
+        app.conf['CELERY_TASK_ALWAYS_EAGER'] = previous
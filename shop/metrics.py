@@ -0,0 +1,253 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def format_labels(names, values, extra=''):
+    labels = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{%s}' % ','.join(labels) if labels else ''
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{format_labels(self.labels, key)} {value}'
+
+
+class SharedCounter:
+    """
+    An unlabelled counter kept in the METRICS_SHARED_CACHE cache, so
+    increments made by any process (e.g. a Celery worker) are exported
+    by every web process.
+    """
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.key = f'metrics:{name}'
+
+    def inc(self, amount=1):
+        cache = caches[settings.METRICS_SHARED_CACHE]
+        cache.add(self.key, 0, None)
+        try:
+            cache.incr(self.key, amount)
+        except ValueError:
+            # Evicted since the add; start over from this increment.
+            cache.set(self.key, amount, None)
+
+    def samples(self):
+        value = caches[settings.METRICS_SHARED_CACHE].get(self.key, 0)
+        yield f'{self.name} {value}'
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0)
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), total)
+                      for key, (counts, total) in self.values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = format_labels(self.labels, key, f'le="{bound}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labels, key)} {total}'
+            yield f'{self.name}_count{format_labels(self.labels, key)} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def shared_counter(self, name, help):
+        return self.register(SharedCounter(name, help))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Request latency by view.',
+    ['endpoint', 'method', 'status'])
+request_queries = registry.histogram(
+    'http_request_db_queries', 'SQL queries per request by view.',
+    ['endpoint'], QUERY_COUNT_BUCKETS)
+query_duration = registry.counter(
+    'http_request_db_query_seconds_total', 'Time spent in SQL by view.',
+    ['endpoint'])
+slow_queries = registry.counter(
+    'http_request_db_slow_queries_total',
+    'SQL queries slower than METRICS_SLOW_QUERY_MS by view.', ['endpoint'])
+response_size = registry.histogram(
+    'http_response_size_bytes', 'Response body size by view.',
+    ['endpoint'], SIZE_BUCKETS)
+
+
+def endpoint_name(request, view_func):
+    # DRF viewsets expose the class and the method -> action mapping;
+    # plain class-based views only the class.
+    cls = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if cls is None:
+        return f'{view_func.__module__}.{view_func.__qualname__}'
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f'{cls.__name__}.{action}'
+
+
+class QueryTracker:
+    def __init__(self, slow_threshold):
+        self.count = 0
+        self.duration = 0.0
+        self.slow = []
+        self.slow_threshold = slow_threshold
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            if self.slow_threshold and elapsed >= self.slow_threshold:
+                self.slow.append((elapsed, sql))
+
+
+class MetricsMiddleware:
+    """
+    Records latency, SQL query count and time, and response size per
+    resolved view and action. Must come first in MIDDLEWARE.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_threshold = settings.METRICS_SLOW_QUERY_MS / 1000
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        tracker = QueryTracker(self.slow_threshold)
+        start = time.perf_counter()
+        with self.tracking(tracker):
+            response = self.get_response(request)
+        self.record(request, response, tracker, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        tracker = QueryTracker(self.slow_threshold)
+        start = time.perf_counter()
+        with self.tracking(tracker):
+            response = await self.get_response(request)
+        self.record(request, response, tracker, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def tracking(tracker):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(tracker))
+        return stack
+
+    def record(self, request, response, tracker, duration):
+        endpoint = getattr(request, 'metrics_endpoint', 'unresolved')
+        request_duration.observe(duration, endpoint=endpoint,
+                                 method=request.method,
+                                 status=response.status_code)
+        request_queries.observe(tracker.count, endpoint=endpoint)
+        query_duration.inc(tracker.duration, endpoint=endpoint)
+        if not response.streaming:
+            response_size.observe(len(response.content), endpoint=endpoint)
+        for elapsed, sql in tracker.slow:
+            slow_queries.inc(endpoint=endpoint)
+            logger.warning('Slow query (%.1f ms) in %s: %s',
+                           elapsed * 1000, endpoint, sql)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_endpoint = endpoint_name(request, view_func)
+
+
+def metrics_view(request):
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS and \
+            not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
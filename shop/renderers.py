@@ -0,0 +1,42 @@
+import datetime
+import orjson
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+datetime_field = serializers.DateTimeField()
+encoder = JSONEncoder()
+
+
+def default(obj):
+    # Datetimes render like DateTimeField (DATETIME_FORMAT); Decimal,
+    # lazy strings and the rest go through DRF's encoder.
+    if isinstance(obj, datetime.datetime):
+        return datetime_field.to_representation(obj)
+    return encoder.default(obj)
+
+
+def dumps(data):
+    ret = orjson.dumps(data, default=default, option=OPTIONS)
+    # Same escaping as JSONRenderer, for JSONP/inline script safety.
+    if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+        ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028') \
+            .replace(b'\xe2\x80\xa9', b'\\u2029')
+    return ret
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer's compact output, encoded with orjson. Indented
+    responses are still rendered by the stdlib encoder.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
@@ -0,0 +1,116 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+STICKY_COOKIE = 'primary_until'
+STICKY_HEADER = 'X-Primary-Until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+reading_replica = ContextVar('reading_replica', default=False)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica_')]
+
+
+@contextmanager
+def use_primary():
+    """Send the reads made inside the block to the primary."""
+    token = reading_replica.set(False)
+    try:
+        yield
+    finally:
+        reading_replica.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to a random replica while the current request has opted
+    in (see ReplicaMiddleware); everything else uses the primary.
+    """
+
+    def __init__(self):
+        self.replicas = replica_aliases()
+        self.aliases = {'default', *self.replicas}
+
+    def db_for_read(self, model, **hints):
+        if self.replicas and reading_replica.get():
+            return random.choice(self.replicas)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._state.db in self.aliases and obj2._state.db in self.aliases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Lets safe requests to views listing the action in ``replica_actions``
+    read from a replica. A successful write pins the client to the
+    primary for STORE_REPLICA_STICKY_SECONDS through a cookie, echoed in
+    a header for clients without a cookie jar, so it reads its own writes.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = reading_replica.set(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            reading_replica.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = reading_replica.set(False)
+        try:
+            response = await self.get_response(request)
+        finally:
+            reading_replica.reset(token)
+        return self.pin(request, response)
+
+    def pin(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            seconds = settings.STORE_REPLICA_STICKY_SECONDS
+            until = str(int(time.time()) + seconds)
+            response.set_cookie(STICKY_COOKIE, until, max_age=seconds,
+                                httponly=True, samesite='Lax')
+            response[STICKY_HEADER] = until
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in SAFE_METHODS or self.pinned(request):
+            return
+        # Viewsets map methods to actions; other class-based views list
+        # the method names themselves.
+        method = request.method.lower()
+        actions = getattr(view_func, 'actions', None) or {}
+        action = actions.get(method, method)
+        cls = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        if action in getattr(cls, 'replica_actions', ()):
+            reading_replica.set(True)
+
+    @staticmethod
+    def pinned(request):
+        value = request.COOKIES.get(STICKY_COOKIE) or \
+            request.headers.get(STICKY_HEADER)
+        try:
+            return int(value) > time.time()
+        except (TypeError, ValueError):
+            return False
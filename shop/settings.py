@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shop.metrics.MetricsMiddleware',
+    'shop.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -130,6 +132,49 @@ database_url = os.environ.get('DATABASE_URL',
 DATABASES = {
     'default': dj_database_url.parse(database_url)
 }
+# Read replicas, used by shop.replicas for catalog and order list reads
+DATABASE_REPLICA_URLS = [
+    url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+for index, replica_url in enumerate(DATABASE_REPLICA_URLS, 1):
+    DATABASES[f'replica_{index}'] = dict(
+        dj_database_url.parse(replica_url), TEST={'MIRROR': 'default'})
+DATABASE_ROUTERS = ['shop.replicas.ReplicaRouter']
+STORE_REPLICA_STICKY_SECONDS = int(
+    os.environ.get('STORE_REPLICA_STICKY_SECONDS', 10))
+# Cache
+REDIS_URL = os.environ.get('REDIS_URL')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+if REDIS_URL:
+    CACHES['catalog'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'store',
+    }
+STORE_CATALOG_CACHE = 'catalog'
+STORE_CATALOG_CACHE_TIMEOUT = int(
+    os.environ.get('STORE_CATALOG_CACHE_TIMEOUT', 300))
+STORE_SLUG_CACHE_SIZE = int(os.environ.get('STORE_SLUG_CACHE_SIZE', 10000))
+# Celery
+CELERY_BROKER_URL = os.environ.get(
+    'CELERY_BROKER_URL', REDIS_URL or 'redis://localhost:6379/0')
+CELERY_TASK_ALWAYS_EAGER = os.environ.get(
+    'CELERY_TASK_ALWAYS_EAGER', 'False') == 'True'
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_BEAT_SCHEDULE = {
+    'purge-expired-carts': {
+        'task': 'store.tasks.purge_carts',
+        'schedule': int(os.environ.get('STORE_CART_PURGE_INTERVAL', 3600)),
+    },
+}
 # Authenticatio
 AUTH_USER_MODEL = 'users.CustomUser'
 
@@ -145,7 +190,7 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DATETIME_FORMAT': '%Y-%m-%dT%H:%M:%S%z',
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'shop.renderers.ORJSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
@@ -153,12 +198,22 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',)
+        'users.authentication.TokenUserAuthentication',)
 }
 # SIMPLE JWT
 
 SIMPLE_JWT = {
-    'ACCESS_TOKEN_LIFETIME': timedelta(days=1), }
+    'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
+    'TOKEN_OBTAIN_SERIALIZER': 'users.authentication.ClaimsTokenObtainPairSerializer', }
+USERS_TOKEN_STATE_CACHE = 'default'
+USERS_TOKEN_STATE_TTL = int(os.environ.get('USERS_TOKEN_STATE_TTL', 60))
+# Metrics
+METRICS_SLOW_QUERY_MS = float(os.environ.get('METRICS_SLOW_QUERY_MS', 500))
+# Counters shared between processes; Redis when REDIS_URL is set
+METRICS_SHARED_CACHE = 'catalog'
+# Who may read /metrics besides staff users; local scrapers by default
+METRICS_ALLOWED_IPS = [
+    ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip]
 # Debug
 INTERNAL_IPS = [
     # ...
@@ -176,3 +231,17 @@ DJSTRIPE_WEBHOOK_SECRET = os.environ.get(
     'DJSTRIPE_WEBHOOK_SECRET', '#')
 DJSTRIPE_FOREIGN_KEY_TO_FIELD = os.environ.get(
     'DJSTRIPE_FOREIGN_KEY_TO_FIELD', 'id')
+STORE_CART_BACKEND = os.environ.get(
+    'STORE_CART_BACKEND', 'store.carts.DatabaseCartStore')
+# Carts without item activity for this long expire (Redis) or are purged.
+STORE_CART_TTL = int(os.environ.get('STORE_CART_TTL', 7 * 24 * 3600))
+STORE_CART_PURGE_BATCH_SIZE = int(os.environ.get('STORE_CART_PURGE_BATCH_SIZE', 500))
+# Editing a line records activity only if the last was longer ago than this.
+STORE_CART_TOUCH_INTERVAL = int(os.environ.get('STORE_CART_TOUCH_INTERVAL', 300))
+STORE_PAYMENT_GATEWAY = os.environ.get(
+    'STORE_PAYMENT_GATEWAY', 'store.payments.StripePaymentGateway')
+STORE_IMAGE_VARIANT_WIDTHS = [
+    int(width) for width in
+    os.environ.get('STORE_IMAGE_VARIANT_WIDTHS', '320,640,1280').split(',')]
+STORE_IMAGE_VARIANT_QUALITY = int(
+    os.environ.get('STORE_IMAGE_VARIANT_QUALITY', 80))
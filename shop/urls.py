@@ -6,12 +6,14 @@ from rest_framework_simplejwt.views import (
 )
 from django.conf.urls.static import static
 from django.conf import settings
+from .metrics import metrics_view
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('store/', include('store.urls')),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('users/', include('users.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path("stripe/", include("djstripe.urls", namespace="djstripe")),
     # in dev only
     path('__debug__/', include('debug_toolbar.urls')),
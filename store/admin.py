@@ -1,9 +1,9 @@
 from django.contrib import admin, messages
-from django.db.models.aggregates import Count
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
 from django.db.models.query import QuerySet
 from . import models
+from .images import smallest_variant
 
 
 class InventoryFilter(admin.SimpleListFilter):
@@ -26,7 +26,9 @@ class ProductImageInline(admin.TabularInline):
 
     def thumbnail(self, instance):
         if instance.image.name != '':
-            return format_html(f'<img src="{instance.image.url}" class="thumbnail" />')
+            name = smallest_variant(instance.variants)
+            url = instance.image.storage.url(name) if name else instance.image.url
+            return format_html(f'<img src="{url}" class="thumbnail" />')
         return ''
 
 
@@ -79,11 +81,6 @@ class CategoryAdmin(admin.ModelAdmin):
             }))
         return format_html('<a href="{}">{} Products</a>', url, category.products_count)
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            products_count=Count('products')
-        )
-
 
 class OrderItemInline(admin.TabularInline):
     autocomplete_fields = ['product']
@@ -97,4 +94,9 @@ class OrderItemInline(admin.TabularInline):
 class OrderAdmin(admin.ModelAdmin):
     autocomplete_fields = ['customer']
     inlines = [OrderItemInline]
-    list_display = ['id', 'placed_at', 'customer']
+    list_display = ['id', 'placed_at', 'customer', 'total_amount']
+    readonly_fields = ['total_amount', 'items_count']
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        models.Order.objects.filter(pk=form.instance.pk).refresh_totals()
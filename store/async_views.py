@@ -0,0 +1,170 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core.paginator import InvalidPage
+from django.http import Http404, HttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated, NotFound, PermissionDenied
+from rest_framework.permissions import AllowAny
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+from shop.renderers import ORJSONRenderer
+from .carts import get_cart_store
+from .models import Category
+from .pagination import KeysetPagination
+from .permissions import IsAdminOrReadOnly
+from .serializers import AddCartItemSerializer, CartSerializer, CategorySerializer, ProductRowSerializer
+from .views import CategoryViewSet, ProductViewSet
+
+
+async def paginate(pagination, queryset, request):
+    """
+    PageNumberPagination.paginate_queryset with the count and the page
+    read through the async ORM.
+    """
+    pagination.request = request
+    paginator = pagination.django_paginator_class(
+        queryset, pagination.get_page_size(request))
+    paginator.count = await queryset.acount()
+    page_number = pagination.get_page_number(request, paginator)
+    try:
+        pagination.page = paginator.page(page_number)
+    except InvalidPage as exc:
+        raise NotFound(pagination.invalid_page_message.format(
+            page_number=page_number, message=str(exc)))
+    return [row async for row in pagination.page.object_list]
+
+
+class AsyncAPIView(View):
+    """
+    Async counterpart of a DRF view for the hot read paths. Requests are
+    wrapped in a DRF Request, checked against ``permission_classes`` and
+    answered with the default JSON renderer; API exceptions go through
+    DRF's exception handler.
+    """
+    permission_classes = [AllowAny]
+    replica_actions = []
+    renderer = ORJSONRenderer()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        request = Request(
+            request,
+            parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+            authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+        self.request = request
+        try:
+            await self.check_permissions(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except Exception as exc:
+            return self.handle_exception(exc)
+
+    def handle_exception(self, exc):
+        # As APIView.handle_exception.
+        if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+            authenticators = self.request.authenticators
+            auth_header = authenticators[0].authenticate_header(self.request) \
+                if authenticators else None
+            if auth_header:
+                exc.auth_header = auth_header
+            else:
+                exc.status_code = status.HTTP_403_FORBIDDEN
+        response = exception_handler(exc, {'view': self, 'request': self.request})
+        if response is None:
+            raise exc
+        headers = {name: value for name, value in response.items()
+                   if name != 'Content-Type'}
+        return self.respond(response.data, response.status_code, headers)
+
+    async def check_permissions(self, request):
+        # Anonymous requests resolve to AnonymousUser without a query;
+        # anything carrying credentials is authenticated in a thread.
+        if 'HTTP_AUTHORIZATION' in request.META or \
+                settings.SESSION_COOKIE_NAME in request.COOKIES:
+            await sync_to_async(lambda: request.user)()
+        for permission in self.permission_classes:
+            if not permission().has_permission(request, self):
+                if request.authenticators and not request.successful_authenticator:
+                    raise NotAuthenticated()
+                raise PermissionDenied()
+
+    def respond(self, data, status=status.HTTP_200_OK, headers=None):
+        return HttpResponse(self.renderer.render(data), status=status,
+                            content_type=self.renderer.media_type,
+                            headers=headers)
+
+    def viewset(self, viewset_class, action):
+        return viewset_class(request=self.request, action=action,
+                             format_kwarg=None, args=self.args,
+                             kwargs=self.kwargs)
+
+
+class ProductListView(AsyncAPIView):
+    permission_classes = [IsAdminOrReadOnly]
+    replica_actions = ['get']
+
+    async def get(self, request):
+        viewset = self.viewset(ProductViewSet, 'list')
+        # Filter validation may look up the category.
+        queryset = await sync_to_async(viewset.filter_queryset)(viewset.get_queryset())
+        pagination = viewset.paginator
+        if isinstance(pagination, KeysetPagination):
+            rows = await sync_to_async(pagination.paginate_queryset)(
+                queryset, request, viewset)
+        else:
+            rows = await paginate(pagination, queryset, request)
+
+        serializer = ProductRowSerializer(
+            rows, many=True, context=viewset.get_serializer_context())
+        await serializer.child.aload_images(rows)
+        return self.respond(pagination.get_paginated_response(serializer.data).data)
+
+
+class ProductDetailView(AsyncAPIView):
+    permission_classes = [IsAdminOrReadOnly]
+    replica_actions = ['get']
+
+    async def get(self, request, pk):
+        viewset = self.viewset(ProductViewSet, 'retrieve')
+        try:
+            product = await viewset.get_queryset().aget(pk=pk)
+        except (ObjectDoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+        serializer = viewset.get_serializer(product)
+        return self.respond(serializer.data)
+
+
+class CategoryListView(AsyncAPIView):
+    permission_classes = [IsAdminOrReadOnly]
+    replica_actions = ['get']
+
+    async def get(self, request):
+        viewset = self.viewset(CategoryViewSet, 'list')
+        categories = [category async for category in Category.objects.all()]
+        serializer = CategorySerializer(
+            categories, many=True, context=viewset.get_serializer_context())
+        return self.respond(serializer.data)
+
+
+class CartDetailView(AsyncAPIView):
+    async def get(self, request, cart_pk):
+        cart = await get_cart_store().aget(cart_pk)
+        if cart is None:
+            raise Http404
+        return self.respond(CartSerializer(cart).data)
+
+
+class CartItemListView(AsyncAPIView):
+    async def post(self, request, cart_pk):
+        serializer = AddCartItemSerializer(
+            data=request.data, context={'cart_id': cart_pk})
+        serializer.is_valid(raise_exception=True)
+        await serializer.asave()
+        return self.respond(serializer.data, status.HTTP_201_CREATED)
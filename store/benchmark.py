@@ -0,0 +1,294 @@
+import asyncio
+import json
+import math
+import random
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from .models import Category, Product, ProductImage, Cart, CartItem, Order, OrderItem
+
+WORDS = ['red', 'blue', 'green', 'black', 'white', 'classic', 'modern', 'light',
+         'heavy', 'cotton', 'leather', 'steel', 'wooden', 'shirt', 'lamp',
+         'table', 'chair', 'phone', 'watch', 'bag', 'shoe', 'cup', 'book', 'pen']
+
+PASSWORD = 'benchmark'
+
+
+@contextmanager
+def test_database(keepdb=False):
+    """Run the block against a throwaway test database."""
+    setup_test_environment(debug=False)
+    old_name = connection.settings_dict['NAME']
+    try:
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=keepdb)
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+def seed(categories=10, products=1000, images=2, users=20, carts=50,
+         orders=200, items=3, random_seed=0):
+    """
+    Fill an empty database with a synthetic catalog. The same arguments
+    always produce the same rows.
+    """
+    rng = random.Random(random_seed)
+
+    Category.objects.bulk_create(
+        Category(title=f'Category {i}') for i in range(categories))
+    category_ids = list(Category.objects.values_list('id', flat=True))
+
+    # Titles are unique so slug generation never has to probe for a suffix.
+    Product.objects.bulk_create(
+        (Product(title=f'{" ".join(rng.sample(WORDS, 3))} {i}',
+                 description=' '.join(rng.choices(WORDS, k=20)),
+                 unit_price=Decimal(rng.randrange(100, 99900)) / 100,
+                 inventory=10 ** 6,
+                 category_id=rng.choice(category_ids))
+         for i in range(products)),
+        batch_size=500)
+    product_ids = list(Product.objects.values_list('id', flat=True))
+    prices = dict(Product.objects.values_list('id', 'unit_price'))
+
+    ProductImage.objects.bulk_create(
+        (ProductImage(product_id=product_id,
+                      image=f'store/images/benchmark-{product_id}-{i}.jpg')
+         for product_id in product_ids for i in range(images)),
+        batch_size=500)
+
+    User = get_user_model()
+    # Hash once; hashing per user would dominate seeding time.
+    template = User()
+    template.set_password(PASSWORD)
+    User.objects.bulk_create(
+        User(username=f'benchmark{i}', email=f'benchmark{i}@example.com',
+             password=template.password, address=f'{i} Benchmark Street',
+             phone=f'+100000{i:05d}')
+        for i in range(users))
+    user_ids = list(User.objects.values_list('id', flat=True))
+
+    Cart.objects.bulk_create(Cart() for _ in range(carts))
+    CartItem.objects.bulk_create(
+        (CartItem(cart=cart, product_id=product_id,
+                  quantity=rng.randint(1, 5))
+         for cart in Cart.objects.all()
+         for product_id in rng.sample(product_ids, min(items, len(product_ids)))),
+        batch_size=500)
+
+    Order.objects.bulk_create(
+        (Order(customer_id=rng.choice(user_ids),
+               payment_status=rng.choice(['P', 'C', 'F']))
+         for _ in range(orders)),
+        batch_size=500)
+    OrderItem.objects.bulk_create(
+        (OrderItem(order_id=order_id, product_id=product_id,
+                   unit_price=prices[product_id], quantity=rng.randint(1, 5))
+         for order_id in Order.objects.values_list('id', flat=True)
+         for product_id in rng.sample(product_ids, min(items, len(product_ids)))),
+        batch_size=500)
+    Order.objects.refresh_totals()
+
+
+class Scenario:
+    """
+    One endpoint under load. ``prepare`` runs untimed before every
+    request and returns the keyword arguments for ``request``.
+    """
+
+    def __init__(self, name, method, path, data=None, user=False, prepare=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.user = user
+        self.prepare = prepare
+
+    def setup(self, client):
+        if self.user:
+            user = get_user_model().objects \
+                .filter(username__startswith='benchmark').order_by('id').first()
+            token = client.post('/api/token/', {'username': user.username,
+                                                'password': PASSWORD}).json()
+            client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {token["access"]}'
+
+    def request(self, client, kwargs=None):
+        if kwargs is None:
+            kwargs = self.prepare(client) if self.prepare else {}
+        path = kwargs.get('path', self.path)
+        data = kwargs.get('data', self.data)
+        if self.method == 'get':
+            return lambda: client.get(path, data)
+        return lambda: client.post(path, data, content_type='application/json')
+
+
+def new_cart(client):
+    return client.post('/store/carts/').json()['id']
+
+
+def cart_with_items(client):
+    cart_id = new_cart(client)
+    for product_id in Product.objects.order_by('id').values_list('id', flat=True)[:3]:
+        client.post(f'/store/carts/{cart_id}/items/',
+                    json.dumps({'product_id': product_id, 'quantity': 1}),
+                    content_type='application/json')
+    return cart_id
+
+
+def default_scenarios():
+    category_id = Category.objects.order_by('id').values_list('id', flat=True).first()
+    product = Product.objects.order_by('id').first()
+    cart_id = CartItem.objects.values_list('cart_id', flat=True).first()
+    return [
+        Scenario('products.list', 'get', '/store/products/'),
+        Scenario('products.list.cursor', 'get', '/store/products/',
+                 {'pagination': 'cursor'}),
+        Scenario('products.search', 'get', '/store/products/',
+                 {'search': 'leather chair'}),
+        Scenario('products.filter', 'get', '/store/products/',
+                 {'category_id': category_id, 'unit_price__lt': 500,
+                  'ordering': '-unit_price'}),
+        Scenario('products.retrieve', 'get', f'/store/products/{product.id}/'),
+        Scenario('carts.retrieve', 'get', f'/store/carts/{cart_id}/'),
+        Scenario('cart_items.create', 'post', None,
+                 prepare=lambda client: {
+                     'path': f'/store/carts/{new_cart(client)}/items/',
+                     'data': {'product_id': product.id, 'quantity': 1}}),
+        Scenario('orders.list', 'get', '/store/orders/', user=True),
+        Scenario('orders.list.summary', 'get', '/store/orders/',
+                 {'summary': 1}, user=True),
+        Scenario('orders.create', 'post', '/store/orders/', user=True,
+                 prepare=lambda client: {
+                     'data': {'cart_id': cart_with_items(client)}}),
+    ]
+
+
+def asgi_scenarios():
+    """Each sync endpoint next to its counterpart under /store/async/."""
+    product = Product.objects.order_by('id').first()
+    cart_id = CartItem.objects.values_list('cart_id', flat=True).first()
+    scenarios = []
+    for name, path in [('products.list', '/store/products/'),
+                       ('products.retrieve', f'/store/products/{product.id}/'),
+                       ('category.list', '/store/category/'),
+                       ('carts.retrieve', f'/store/carts/{cart_id}/')]:
+        scenarios.append(Scenario(f'{name}.sync', 'get', path))
+        scenarios.append(Scenario(f'{name}.async', 'get',
+                                  path.replace('/store/', '/store/async/', 1)))
+    # SQLite's shared-cache test database fails concurrent writers with
+    # "table is locked" instead of waiting for them.
+    if connection.vendor == 'sqlite':
+        return scenarios
+    for prefix in ('/store/', '/store/async/'):
+        scenarios.append(Scenario(
+            f'cart_items.create.{"async" if "async" in prefix else "sync"}',
+            'post', None,
+            prepare=lambda client, prefix=prefix: {
+                'path': f'{prefix}carts/{new_cart(client)}/items/',
+                'data': {'product_id': product.id, 'quantity': 1}}))
+    return scenarios
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def run_scenario(scenario, iterations, warmup):
+    client = Client()
+    scenario.setup(client)
+    for _ in range(warmup):
+        scenario.request(client)()
+
+    timings, queries = [], []
+    for _ in range(iterations):
+        send = scenario.request(client)
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = send()
+            timings.append(time.perf_counter() - start)
+        check_response(scenario, response)
+        queries.append(len(context))
+    return summarize(iterations / sum(timings), timings, max(queries))
+
+
+def run_concurrent(scenario, iterations, warmup, concurrency):
+    """
+    Send ``iterations`` requests through the ASGI handler, at most
+    ``concurrency`` at a time. Like an ASGI server, every request gets its
+    own ThreadSensitiveContext, so sync code of different requests runs
+    on different threads. Queries are counted on one sequential request.
+    """
+    client = Client()
+    scenario.setup(client)
+    for _ in range(warmup):
+        scenario.request(client)()
+    with CaptureQueriesContext(connection) as context:
+        check_response(scenario, scenario.request(client)())
+    # Prepared up front: ``prepare`` uses the sync client.
+    prepared = [scenario.prepare(client) if scenario.prepare else {}
+                for _ in range(iterations)]
+
+    async def send(async_client, semaphore, kwargs, timings):
+        async with semaphore, ThreadSensitiveContext():
+            start = time.perf_counter()
+            response = await scenario.request(async_client, kwargs)()
+            timings.append(time.perf_counter() - start)
+            # The test client skips the close_old_connections a server runs.
+            await sync_to_async(connections.close_all)()
+        check_response(scenario, response)
+
+    async def run():
+        async_client, timings = AsyncClient(), []
+        semaphore = asyncio.Semaphore(concurrency)
+        start = time.perf_counter()
+        await asyncio.gather(*(send(async_client, semaphore, kwargs, timings)
+                               for kwargs in prepared))
+        return time.perf_counter() - start, timings
+
+    elapsed, timings = asyncio.run(run())
+    return summarize(iterations / elapsed, timings, len(context))
+
+
+def check_response(scenario, response):
+    if response.status_code >= 400:
+        raise RuntimeError(
+            f'{scenario.name} returned {response.status_code}: '
+            f'{response.content[:200]!r}')
+
+
+def summarize(throughput, timings, queries):
+    return {
+        'requests': len(timings),
+        'throughput': throughput,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'queries': queries,
+    }
+
+
+def compare(baseline, results, tolerance=0.1):
+    """
+    Yield ``(scenario, metric, before, after)`` for every metric that got
+    worse than ``baseline`` by more than ``tolerance``. Query counts must
+    not grow at all.
+    """
+    for name, after in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if after['queries'] > before['queries']:
+            yield name, 'queries', before['queries'], after['queries']
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if after[metric] > before[metric] * (1 + tolerance):
+                yield name, metric, before[metric], after[metric]
+        if after['throughput'] < before['throughput'] * (1 - tolerance):
+            yield name, 'throughput', before['throughput'], after['throughput']
@@ -0,0 +1,188 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from rest_framework.response import Response
+from shop.replicas import reading_replica, replica_aliases, use_primary
+
+CATALOG_VERSION_KEY = 'catalog:version'
+CATALOG_MODIFIED_KEY = 'catalog:modified'
+CATALOG_SETTLING_KEY = 'catalog:settling'
+
+
+def get_catalog_cache():
+    return caches[settings.STORE_CATALOG_CACHE]
+
+
+def get_catalog_version():
+    cache = get_catalog_cache()
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Seed from the clock so an evicted version never goes back to a
+        # value that older entries were stored under.
+        cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def get_catalog_modified():
+    """Unix time (seconds) of the last catalog version bump."""
+    cache = get_catalog_cache()
+    modified = cache.get(CATALOG_MODIFIED_KEY)
+    if modified is None:
+        modified = int(time.time())
+        cache.add(CATALOG_MODIFIED_KEY, modified, None)
+        modified = cache.get(CATALOG_MODIFIED_KEY, modified)
+    return modified
+
+
+def catalog_epoch():
+    """
+    Start (Unix seconds) of the current STORE_CATALOG_CACHE_TIMEOUT window.
+    Validators change with it, so volatile fields that do not bump the
+    catalog version go no longer stale behind an ETag than in the cache.
+    """
+    now = int(time.time())
+    timeout = settings.STORE_CATALOG_CACHE_TIMEOUT
+    return now - now % timeout if timeout > 0 else now
+
+
+def bump_catalog_version():
+    cache = get_catalog_cache()
+    if replica_aliases():
+        # Set before the bump so no read under the new version misses it.
+        cache.set(CATALOG_SETTLING_KEY, True,
+                  settings.STORE_REPLICA_STICKY_SECONDS)
+    try:
+        version = cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        version = get_catalog_version()
+    # Set after the bump: a reader between the two sees an older
+    # Last-Modified for fresh data, never a newer one for stale data.
+    cache.set(CATALOG_MODIFIED_KEY, int(time.time()), None)
+    return version
+
+
+def catalog_reads():
+    """
+    Wraps the reads behind a cached response or its validators. For
+    STORE_REPLICA_STICKY_SECONDS after a catalog write they go to the
+    primary: a lagging replica's answer would be cached and tagged under
+    the new catalog version.
+    """
+    if reading_replica.get() and get_catalog_cache().get(CATALOG_SETTLING_KEY):
+        return use_primary()
+    return nullcontext()
+
+
+def catalog_cache_key(prefix, request):
+    path = request.get_host() + request.path
+    query = sorted(request.query_params.lists())
+    digest = hashlib.md5(f'{path}?{query}'.encode()).hexdigest()
+    return f'catalog:{get_catalog_version()}:{prefix}:{digest}'
+
+
+class LRUCache:
+    """A small thread-safe, in-process least-recently-used mapping."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+# slug -> product id. Per process, so readers must check the fetched
+# product's slug; the handlers only evict entries for this process.
+product_slugs = LRUCache(settings.STORE_SLUG_CACHE_SIZE)
+
+
+class CatalogCacheMixin:
+    cache_prefix = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        cache = get_catalog_cache()
+        key = catalog_cache_key(f'{self.cache_prefix}:{self.action}', request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        with catalog_reads():
+            response = handler(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            cache.set(key, response.data, settings.STORE_CATALOG_CACHE_TIMEOUT)
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Answers If-None-Match / If-Modified-Since before any serialization.
+    Validators cost no query: the ETag hashes the catalog cache key (the
+    catalog version and the request URL) with the negotiated format and
+    the catalog epoch, and Last-Modified is the later of the last catalog
+    version bump and the start of the epoch.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            with catalog_reads():
+                response = handler(request, *args, **kwargs)
+
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def get_validators(self, request):
+        key = catalog_cache_key(f'etag:{request.accepted_renderer.format}', request)
+        epoch = catalog_epoch()
+        etag = quote_etag(hashlib.md5(f'{key}:{epoch}'.encode()).hexdigest())
+
+        # HTTP dates have one-second resolution; a bump later in the
+        # current second would not move it, so leave it out until then.
+        last_modified = max(get_catalog_modified(), epoch)
+        if last_modified >= int(time.time()):
+            last_modified = None
+        return etag, last_modified
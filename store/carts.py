@@ -0,0 +1,540 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from uuid import UUID, uuid4
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Subquery
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from shop.metrics import registry
+from .inventory import InsufficientStock
+from .models import Cart, CartItem, Product
+
+logger = logging.getLogger(__name__)
+
+# Purges run in the Celery worker, which serves no /metrics.
+carts_purged = registry.shared_counter(
+    'store_carts_purged_total', 'Carts deleted after STORE_CART_TTL without activity.')
+
+
+class CartNotFound(Exception):
+    pass
+
+
+class ProductNotFound(Exception):
+    pass
+
+
+def parse_cart_id(value):
+    try:
+        return value if isinstance(value, UUID) else UUID(str(value))
+    except ValueError:
+        return None
+
+
+def parse_item_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def check_lines(quantities):
+    """
+    Split ``{product_id: quantity}`` into lines that can be applied and
+    ``{product_id: error}``, reading every product in one query. A zero
+    quantity removes the line and needs no product.
+    """
+    inventory = dict(Product.objects
+                     .filter(pk__in=[product_id for product_id, quantity
+                                     in quantities.items() if quantity])
+                     .values_list('pk', 'inventory'))
+    valid, errors = {}, {}
+    for product_id, quantity in quantities.items():
+        if quantity and product_id not in inventory:
+            errors[product_id] = 'No product with the given ID was found.'
+        elif quantity > inventory.get(product_id, 0):
+            errors[product_id] = \
+                "You have entered a quantity that is more than the product's availabe quantity"
+        else:
+            valid[product_id] = quantity
+    return valid, errors
+
+
+class DatabaseCartStore:
+    """Carts live in the store_cart / store_cartitem tables."""
+
+    def create(self):
+        cart = Cart.objects.create()
+        cart.line_items = []
+        cart.total_price = 0
+        return cart
+
+    def exists(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        return cart_id is not None and Cart.objects.filter(pk=cart_id).exists()
+
+    def has_items(self, cart_id):
+        return CartItem.objects.filter(cart_id=cart_id).exists()
+
+    def get(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        if cart_id is None:
+            return None
+        return Cart.objects.with_totals().filter(pk=cart_id).first()
+
+    async def aget(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        if cart_id is None:
+            return None
+        return await Cart.objects.with_totals().filter(pk=cart_id).afirst()
+
+    def delete(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        if cart_id is None:
+            return False
+        deleted, _ = Cart.objects.filter(pk=cart_id).delete()
+        return deleted > 0
+
+    def get_items(self, cart_id):
+        return list(self._items(cart_id))
+
+    def get_item(self, cart_id, item_id):
+        item_id = parse_item_id(item_id)
+        if item_id is None:
+            return None
+        return self._items(cart_id).filter(pk=item_id).first()
+
+    def add_item(self, cart_id, product_id, quantity):
+        cart_id = parse_cart_id(cart_id)
+        if cart_id is None:
+            raise CartNotFound(cart_id)
+        if connections[CartItem.objects.db].vendor == 'postgresql':
+            cart_item = self._upsert_item(cart_id, product_id, quantity)
+        else:
+            cart_item = self._add_item_orm(cart_id, product_id, quantity)
+        if cart_item is None:
+            raise self._add_item_error(cart_id, product_id)
+        return cart_item
+
+    async def aadd_item(self, cart_id, product_id, quantity):
+        # The ORM fallback needs an atomic block, which is sync-only.
+        return await sync_to_async(self.add_item)(cart_id, product_id, quantity)
+
+    def _upsert_item(self, cart_id, product_id, quantity):
+        # One statement: touch the cart, then insert the line, or add to
+        # it on a (cart_id, product_id) conflict, but only while the
+        # product has enough inventory. The touch locks the cart, so a
+        # cart the purge is deleting yields no row rather than a foreign
+        # key violation. No row back means nothing was written.
+        connection = connections[CartItem.objects.db]
+        cart_item = connection.ops.quote_name(CartItem._meta.db_table)
+        cart = connection.ops.quote_name(Cart._meta.db_table)
+        product = connection.ops.quote_name(Product._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'WITH c AS (UPDATE {cart} SET updated_at = %s WHERE id = %s RETURNING id) '
+                f'INSERT INTO {cart_item} (cart_id, product_id, quantity) '
+                f'SELECT c.id, p.id, %s FROM c, {product} p '
+                f'WHERE p.id = %s AND p.inventory >= %s '
+                f'ON CONFLICT (cart_id, product_id) DO UPDATE '
+                f'SET quantity = {cart_item}.quantity + EXCLUDED.quantity '
+                f'WHERE {cart_item}.quantity + EXCLUDED.quantity <= '
+                f'(SELECT inventory FROM {product} WHERE id = EXCLUDED.product_id) '
+                f'RETURNING id, quantity',
+                [timezone.now(), Cart._meta.pk.get_db_prep_value(cart_id, connection),
+                 quantity, product_id, quantity])
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return CartItem(id=row[0], cart_id=cart_id,
+                        product_id=product_id, quantity=row[1])
+
+    def _add_item_orm(self, cart_id, product_id, quantity):
+        inventory = Product.objects.filter(pk=product_id).values('inventory')
+        with transaction.atomic():
+            # As in set_quantities, touching the cart first locks it
+            # against the purge and tells whether it still exists.
+            if not self.touch(cart_id):
+                return None
+            updated = CartItem.objects \
+                .filter(cart_id=cart_id, product_id=product_id,
+                        quantity__lte=Subquery(inventory) - quantity) \
+                .update(quantity=F('quantity') + quantity)
+            if updated:
+                return CartItem.objects.get(
+                    cart_id=cart_id, product_id=product_id)
+
+            if Product.objects.filter(pk=product_id, inventory__gte=quantity).exists():
+                try:
+                    with transaction.atomic():
+                        return CartItem.objects.create(
+                            cart_id=cart_id, product_id=product_id,
+                            quantity=quantity)
+                except IntegrityError:
+                    # The line exists but has no room for this quantity.
+                    pass
+        return None
+
+    def _add_item_error(self, cart_id, product_id):
+        # Only reached when nothing was written, so the extra reads stay
+        # off the success path.
+        if not Cart.objects.filter(pk=cart_id).exists():
+            return CartNotFound(cart_id)
+        if not Product.objects.filter(pk=product_id).exists():
+            return ProductNotFound(product_id)
+        return InsufficientStock([product_id])
+
+    def update_item(self, cart_id, item_id, quantity):
+        updated = self._items(cart_id) \
+            .filter(pk=parse_item_id(item_id)) \
+            .update(quantity=quantity)
+        if not updated:
+            return None
+        self.mark_active(cart_id)
+        return self.get_item(cart_id, item_id)
+
+    def remove_item(self, cart_id, item_id):
+        deleted, _ = self._items(cart_id) \
+            .filter(pk=parse_item_id(item_id)) \
+            .delete()
+        if deleted:
+            self.mark_active(cart_id)
+        return deleted > 0
+
+    def set_quantities(self, cart_id, quantities):
+        cart_id = parse_cart_id(cart_id)
+        valid, errors = check_lines(quantities)
+        with transaction.atomic():
+            # Touching the cart first locks it against the purge and tells
+            # whether it still exists.
+            if cart_id is None or not self.touch(cart_id):
+                raise CartNotFound(cart_id)
+            # An upsert, so a line added concurrently is overwritten
+            # rather than failing the insert on (cart_id, product_id).
+            CartItem.objects.bulk_create(
+                [CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                 for product_id, quantity in valid.items() if quantity],
+                update_conflicts=True, unique_fields=['cart', 'product'],
+                update_fields=['quantity'])
+            removals = [product_id
+                        for product_id, quantity in valid.items() if not quantity]
+            if removals:
+                CartItem.objects \
+                    .filter(cart_id=cart_id, product_id__in=removals) \
+                    .delete()
+        return errors
+
+    def flush(self, cart_id):
+        # Already relational. Touching the row during checkout keeps the
+        # purge off it: the purge skips locked and recently active carts.
+        self.touch(cart_id)
+
+    def touch(self, cart_id):
+        return Cart.objects.filter(pk=cart_id).update(updated_at=timezone.now())
+
+    def mark_active(self, cart_id):
+        # Against a TTL of days, rewriting the cart row on every edit buys
+        # nothing; only carts idle for STORE_CART_TOUCH_INTERVAL are written.
+        now = timezone.now()
+        Cart.objects \
+            .filter(pk=cart_id,
+                    updated_at__lt=now - timedelta(seconds=settings.STORE_CART_TOUCH_INTERVAL)) \
+            .update(updated_at=now)
+
+    def evict(self, cart_id):
+        pass
+
+    def _items(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        if cart_id is None:
+            return CartItem.objects.none()
+        return CartItem.objects \
+            .filter(cart_id=cart_id) \
+            .select_related('product') \
+            .with_totals()
+
+
+class RedisCartStore:
+    """
+    One Redis hash per cart mapping product id to quantity. The product
+    id doubles as the cart item id. Carts are written to the relational
+    tables only at checkout, by ``flush``.
+    """
+    key_prefix = 'cart:'
+    created_field = '_created'
+
+    def __init__(self, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(
+                settings.REDIS_URL, decode_responses=True)
+        self.client = client
+
+    def key(self, cart_id):
+        return f'{self.key_prefix}{cart_id}'
+
+    def touch(self, key):
+        self.client.expire(key, settings.STORE_CART_TTL)
+
+    def create(self):
+        cart = Cart(id=uuid4(), created_at=timezone.now())
+        key = self.key(cart.id)
+        self.client.hset(key, self.created_field, cart.created_at.isoformat())
+        self.touch(key)
+        cart.line_items = []
+        cart.total_price = 0
+        return cart
+
+    def exists(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        return cart_id is not None and bool(self.client.exists(self.key(cart_id)))
+
+    def has_items(self, cart_id):
+        return bool(self._quantities(self.client.hgetall(self.key(cart_id))))
+
+    def get(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        if cart_id is None:
+            return None
+        fields = self.client.hgetall(self.key(cart_id))
+        if not fields:
+            return None
+        cart = Cart(id=cart_id)
+        cart.line_items = self._build_items(cart_id, self._quantities(fields))
+        cart.total_price = sum(
+            (item.total_price for item in cart.line_items), Decimal(0))
+        return cart
+
+    async def aget(self, cart_id):
+        # redis-py's client here is blocking; keep it off the event loop.
+        return await sync_to_async(self.get)(cart_id)
+
+    def delete(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        return cart_id is not None and bool(self.client.delete(self.key(cart_id)))
+
+    def get_items(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        if cart_id is None:
+            return []
+        fields = self.client.hgetall(self.key(cart_id))
+        return self._build_items(cart_id, self._quantities(fields))
+
+    def get_item(self, cart_id, item_id):
+        cart_id, item_id = parse_cart_id(cart_id), parse_item_id(item_id)
+        if cart_id is None or item_id is None:
+            return None
+        quantity = self.client.hget(self.key(cart_id), str(item_id))
+        if quantity is None:
+            return None
+        items = self._build_items(cart_id, {item_id: int(quantity)})
+        return items[0] if items else None
+
+    def add_item(self, cart_id, product_id, quantity):
+        if not self.exists(cart_id):
+            raise CartNotFound(cart_id)
+        inventory = Product.objects \
+            .filter(pk=product_id) \
+            .values_list('inventory', flat=True) \
+            .first()
+        if inventory is None:
+            raise ProductNotFound(product_id)
+        if quantity > inventory:
+            raise InsufficientStock([product_id])
+
+        key = self.key(cart_id)
+        # Increment first and undo on overflow so concurrent adds never
+        # leave more in the cart than is in stock.
+        total = self.client.hincrby(key, str(product_id), quantity)
+        if total > inventory:
+            self.client.hincrby(key, str(product_id), -quantity)
+            raise InsufficientStock([product_id])
+        self.touch(key)
+        return CartItem(id=product_id, cart_id=cart_id,
+                        product_id=product_id, quantity=total)
+
+    async def aadd_item(self, cart_id, product_id, quantity):
+        return await sync_to_async(self.add_item)(cart_id, product_id, quantity)
+
+    def update_item(self, cart_id, item_id, quantity):
+        key, field = self.key(cart_id), str(parse_item_id(item_id))
+        if not self.client.hexists(key, field):
+            return None
+        self.client.hset(key, field, quantity)
+        self.touch(key)
+        return self.get_item(cart_id, item_id)
+
+    def remove_item(self, cart_id, item_id):
+        key = self.key(cart_id)
+        removed = bool(self.client.hdel(key, str(parse_item_id(item_id))))
+        if removed:
+            self.touch(key)
+        return removed
+
+    def set_quantities(self, cart_id, quantities):
+        if not self.exists(cart_id):
+            raise CartNotFound(cart_id)
+        valid, errors = check_lines(quantities)
+        key = self.key(cart_id)
+        updates = {str(product_id): quantity
+                   for product_id, quantity in valid.items() if quantity}
+        removals = [str(product_id)
+                    for product_id, quantity in valid.items() if not quantity]
+        if updates:
+            self.client.hset(key, mapping=updates)
+        if removals:
+            self.client.hdel(key, *removals)
+        self.touch(key)
+        return errors
+
+    def flush(self, cart_id):
+        quantities = self._quantities(self.client.hgetall(self.key(cart_id)))
+        with transaction.atomic():
+            Cart.objects.get_or_create(pk=cart_id)
+            CartItem.objects.filter(cart_id=cart_id).delete()
+            CartItem.objects.bulk_create([
+                CartItem(cart_id=cart_id, product_id=product_id,
+                         quantity=quantity)
+                for product_id, quantity in quantities.items()
+            ])
+
+    def evict(self, cart_id):
+        self.client.delete(self.key(cart_id))
+
+    def _quantities(self, fields):
+        return {int(product_id): int(quantity)
+                for product_id, quantity in fields.items()
+                if product_id != self.created_field}
+
+    def _build_items(self, cart_id, quantities):
+        products = Product.objects \
+            .filter(pk__in=quantities) \
+            .only('id', 'title', 'unit_price') \
+            .order_by('pk')
+        items = []
+        for product in products:
+            item = CartItem(id=product.id, cart_id=cart_id,
+                            product=product, quantity=quantities[product.id])
+            item.total_price = item.quantity * product.unit_price
+            items.append(item)
+        return items
+
+
+class InMemoryRedis:
+    """The handful of Redis hash commands RedisCartStore uses, in memory."""
+
+    def __init__(self):
+        self.data = defaultdict(dict)
+        self.expires = {}
+        self.lock = threading.Lock()
+
+    def _expire_stale(self, name):
+        deadline = self.expires.get(name)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(name, None)
+            self.expires.pop(name, None)
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        with self.lock:
+            self._expire_stale(name)
+            created = [key for key in items if key not in self.data[name]]
+            self.data[name].update(
+                (key, str(value)) for key, value in items.items())
+            return len(created)
+
+    def hget(self, name, key):
+        return self.hgetall(name).get(key)
+
+    def hgetall(self, name):
+        with self.lock:
+            self._expire_stale(name)
+            return dict(self.data.get(name, {}))
+
+    def hexists(self, name, key):
+        return key in self.hgetall(name)
+
+    def hincrby(self, name, key, amount=1):
+        with self.lock:
+            self._expire_stale(name)
+            value = int(self.data[name].get(key, 0)) + amount
+            self.data[name][key] = str(value)
+            return value
+
+    def hdel(self, name, *keys):
+        with self.lock:
+            self._expire_stale(name)
+            fields = self.data.get(name, {})
+            return sum(fields.pop(key, None) is not None for key in keys)
+
+    def expire(self, name, seconds):
+        with self.lock:
+            self._expire_stale(name)
+            if not self.data.get(name):
+                return False
+            self.expires[name] = time.monotonic() + seconds
+            return True
+
+    def exists(self, *names):
+        return sum(bool(self.hgetall(name)) for name in names)
+
+    def delete(self, *names):
+        with self.lock:
+            for name in names:
+                self._expire_stale(name)
+                self.expires.pop(name, None)
+            return sum(self.data.pop(name, None) is not None for name in names)
+
+
+class InMemoryCartStore(RedisCartStore):
+    def __init__(self):
+        super().__init__(client=InMemoryRedis())
+
+
+_stores = {}
+
+
+def get_cart_store():
+    path = settings.STORE_CART_BACKEND
+    if path not in _stores:
+        _stores[path] = import_string(path)()
+    return _stores[path]
+
+
+def purge_expired_carts(batch_size=500, max_batches=None, pause=0):
+    """
+    Delete database carts with no item activity for STORE_CART_TTL, oldest
+    first, ``batch_size`` carts per transaction. Where the database
+    supports it, carts locked by a checkout are skipped rather than waited
+    for. Returns the number of carts deleted.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.STORE_CART_TTL)
+    skip_locked = connections[Cart.objects.db].features.has_select_for_update_skip_locked
+    purged = batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            expired = Cart.objects.filter(updated_at__lt=cutoff).order_by('updated_at')
+            if skip_locked:
+                expired = expired.select_for_update(skip_locked=True)
+            ids = list(expired.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            _, deleted = Cart.objects.filter(pk__in=ids).delete()
+            deleted = deleted.get(Cart._meta.label, 0)
+        purged += deleted
+        batches += 1
+        carts_purged.inc(deleted)
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    logger.info('Purged %d expired carts in %d batches.', purged, batches)
+    return purged
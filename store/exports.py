@@ -0,0 +1,85 @@
+import csv
+import io
+from itertools import islice
+from shop.renderers import dumps
+from .models import OrderItem
+
+ORDER_FIELDS = ['id', 'customer_id', 'placed_at', 'payment_status',
+                'total_amount', 'items_count']
+ITEM_FIELDS = ['product_id', 'product__title', 'quantity', 'unit_price']
+CSV_HEADER = ['order_id', 'customer_id', 'placed_at', 'payment_status',
+              'total_amount', 'items_count', 'product_id', 'product_title',
+              'quantity', 'unit_price']
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def iter_orders(queryset, chunk_size=2000):
+    """
+    Yield ``(order, items)`` value dicts in id order. Orders are read
+    through a server-side cursor where the database has one, and the
+    items of each chunk are fetched in one query.
+    """
+    orders = queryset.order_by('id').values(*ORDER_FIELDS) \
+        .iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(orders, chunk_size))
+        if not chunk:
+            return
+        items = {order['id']: [] for order in chunk}
+        for item in OrderItem.objects \
+                .filter(order_id__in=list(items)) \
+                .order_by('order_id', 'id') \
+                .values('order_id', *ITEM_FIELDS):
+            items[item.pop('order_id')].append(item)
+        for order in chunk:
+            yield order, items[order['id']]
+
+
+def ndjson_lines(queryset, chunk_size=2000):
+    for order, items in iter_orders(queryset, chunk_size):
+        yield dumps({
+            'id': order['id'],
+            'customer': order['customer_id'],
+            'placed_at': order['placed_at'].isoformat(),
+            'payment_status': order['payment_status'],
+            # Strings keep amounts exact.
+            'total_price': str(order['total_amount']),
+            'items_count': order['items_count'],
+            'items': [{
+                'product_id': item['product_id'],
+                'product_title': item['product__title'],
+                'quantity': item['quantity'],
+                'unit_price': str(item['unit_price']),
+            } for item in items],
+        }) + b'\n'
+
+
+def csv_lines(queryset, chunk_size=2000):
+    # One row per order item; orders without items get one row.
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for order, items in iter_orders(queryset, chunk_size):
+        head = [order['id'], order['customer_id'], order['placed_at'].isoformat(),
+                order['payment_status'], order['total_amount'], order['items_count']]
+        for item in items or [dict.fromkeys(ITEM_FIELDS, '')]:
+            writer.writerow(head + [item[field] for field in ITEM_FIELDS])
+        if buffer.tell() >= 65536:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+EXPORTERS = {
+    'ndjson': ndjson_lines,
+    'csv': csv_lines,
+}
+
+
+def export_orders(queryset, export_format, chunk_size=2000):
+    return EXPORTERS[export_format](queryset, chunk_size)
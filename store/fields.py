@@ -0,0 +1,50 @@
+from autoslug import AutoSlugField
+from autoslug.utils import crop_slug
+
+
+class PreallocatedSlugField(AutoSlugField):
+    """
+    AutoSlugField that keeps a slug already assigned by a SlugAllocator
+    instead of querying for rivals, so bulk inserts stay one query.
+    """
+
+    def pre_save(self, instance, add):
+        if getattr(instance, '_slug_preallocated', False):
+            return getattr(instance, self.attname)
+        return super().pre_save(instance, add)
+
+
+class SlugAllocator:
+    """
+    Hands out unique slugs the way AutoSlugField does (``slug``,
+    ``slug-2``, ``slug-3``...), checking an in-memory set of taken slugs
+    instead of the database.
+    """
+
+    def __init__(self, field, taken):
+        self.field = field
+        self.taken = set(taken)
+        # Last suffix handed out per base slug; every lower one is taken.
+        self.indexes = {}
+
+    def allocate(self, value):
+        slug = crop_slug(self.field, self.field.slugify(value) or
+                         self.field.model._meta.model_name)
+        base, index = slug, self.indexes.get(slug, 1)
+        if index > 1:
+            slug = self.suffixed(base, index)
+        while slug in self.taken:
+            index += 1
+            slug = self.suffixed(base, index)
+        self.taken.add(slug)
+        self.indexes[base] = index
+        return slug
+
+    def suffixed(self, slug, index):
+        tail_length = len(self.field.index_sep) + len(str(index))
+        if self.field.max_length < len(slug) + tail_length:
+            slug = slug[:self.field.max_length - tail_length]
+        return f'{slug}{self.field.index_sep}{index}'
+
+    def reserve(self, slug):
+        self.taken.add(slug)
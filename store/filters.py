@@ -1,5 +1,8 @@
-from django_filters.rest_framework import FilterSet
-from .models import Product
+from django_filters.rest_framework import FilterSet, IsoDateTimeFilter
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+from .models import Order, Product
+from .search import search_products
 
 
 class ProductFilter(FilterSet):
@@ -9,3 +12,32 @@ class ProductFilter(FilterSet):
             'category_id': ['exact'],
             'unit_price': ['gt', 'lt']
         }
+
+
+class OrderExportFilter(FilterSet):
+    placed_after = IsoDateTimeFilter(field_name='placed_at', lookup_expr='gte')
+    placed_before = IsoDateTimeFilter(field_name='placed_at', lookup_expr='lt')
+
+    class Meta:
+        model = Order
+        fields = ['payment_status']
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    Ranked full-text search over the indexed product search document.
+    Falls back to SearchFilter's icontains lookups on databases without
+    a full-text backend.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        results = search_products(queryset, ' '.join(terms))
+        if results is None:
+            return super().filter_queryset(request, queryset, view)
+        if request.query_params.get(api_settings.ORDERING_PARAM):
+            return results
+        return results.order_by('-search_rank', 'id')
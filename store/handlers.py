@@ -0,0 +1,95 @@
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
+from django.dispatch import receiver
+from .cache import bump_catalog_version, product_slugs
+from .images import delete_variants
+from .models import Category, Product, ProductImage
+from .search import get_search_backend
+from .signals import catalog_changed
+from .tasks import generate_image_variants
+
+
+def invalidate_catalog_cache(sender, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+for model in (Category, Product, ProductImage):
+    for signal in (post_save, post_delete, catalog_changed):
+        signal.connect(invalidate_catalog_cache, sender=model)
+
+
+@receiver(post_save, sender=Product)
+def update_products_count_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_loaded_category_id', None)
+    if created:
+        adjust_products_count(instance.category_id, 1)
+    elif previous is not None and previous != instance.category_id:
+        adjust_products_count(previous, -1)
+        adjust_products_count(instance.category_id, 1)
+
+
+@receiver(post_delete, sender=Product)
+def update_products_count_on_delete(sender, instance, **kwargs):
+    adjust_products_count(instance.category_id, -1)
+
+
+def adjust_products_count(category_id, delta):
+    Category.objects.filter(pk=category_id).update(
+        products_count=F('products_count') + delta)
+
+
+@receiver(post_save, sender=Product)
+def forget_changed_slug(sender, instance, **kwargs):
+    previous = getattr(instance, '_loaded_slug', None)
+    if previous is not None and previous != instance.slug:
+        product_slugs.delete(previous)
+    instance._loaded_slug = instance.slug
+
+
+@receiver(post_delete, sender=Product)
+def forget_deleted_slug(sender, instance, **kwargs):
+    product_slugs.delete(instance.slug)
+
+
+@receiver(catalog_changed, sender=Product)
+def forget_updated_slugs(sender, fields=(), **kwargs):
+    if 'slug' in fields:
+        product_slugs.clear()
+
+
+@receiver(pre_save, sender=ProductImage)
+def reset_image_variants(sender, instance, **kwargs):
+    # Variants of a replaced upload are stale; drop them with this save.
+    instance._image_changed = \
+        instance.image.name != getattr(instance, '_loaded_image', None)
+    if instance._image_changed and instance.variants:
+        stale, storage = instance.variants, instance.image.storage
+        transaction.on_commit(lambda: delete_variants(stale, storage))
+        instance.variants = {}
+
+
+@receiver(post_save, sender=ProductImage)
+def schedule_image_variants(sender, instance, **kwargs):
+    if instance._image_changed and instance.image:
+        transaction.on_commit(
+            lambda: generate_image_variants.delay(instance.pk))
+    instance._loaded_image = instance.image.name
+
+
+@receiver(post_delete, sender=ProductImage)
+def delete_image_variants(sender, instance, **kwargs):
+    if instance.variants:
+        variants, storage = instance.variants, instance.image.storage
+        transaction.on_commit(lambda: delete_variants(variants, storage))
+
+
+@receiver(post_migrate)
+def ensure_search_schema(sender, using, **kwargs):
+    # SQLite drops triggers when a migration rebuilds the product table.
+    if sender.name != 'store':
+        return
+    connection = connections[using]
+    backend = get_search_backend(connection)
+    if backend is not None:
+        backend.install(connection)
@@ -0,0 +1,67 @@
+import os
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+
+def variant_widths(width):
+    widths = [w for w in sorted(settings.STORE_IMAGE_VARIANT_WIDTHS) if w < width]
+    # Never upscale; an image narrower than every width gets one variant.
+    return widths or [width]
+
+
+def encode(image, image_format):
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, image_format,
+               quality=settings.STORE_IMAGE_VARIANT_QUALITY, optimize=True)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_variants(field_file):
+    """
+    Write resized WebP and JPEG copies of ``field_file`` next to it and
+    return ``{format: {width: name}}`` for ProductImage.variants.
+    """
+    with field_file.open('rb') as f:
+        original = ImageOps.exif_transpose(Image.open(f))
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA')
+
+    storage = field_file.storage
+    directory, filename = os.path.split(field_file.name)
+    stem = os.path.splitext(filename)[0]
+    variants = {key: {} for key in FORMATS}
+    for width in variant_widths(original.width):
+        height = max(round(original.height * width / original.width), 1)
+        resized = original.resize((width, height), Image.LANCZOS)
+        for key, (image_format, extension) in FORMATS.items():
+            name = storage.save(
+                f'{directory}/variants/{stem}-{width}.{extension}',
+                encode(resized, image_format))
+            variants[key][str(width)] = name
+    return variants
+
+
+def delete_variants(variants, storage):
+    for names in variants.values():
+        for name in names.values():
+            storage.delete(name)
+
+
+def smallest_variant(variants, key='jpeg'):
+    names = variants.get(key)
+    if not names:
+        return None
+    return names[min(names, key=int)]
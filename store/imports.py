@@ -0,0 +1,160 @@
+import csv
+import json
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_slug
+from django.db import transaction
+from django.utils import timezone
+from .fields import SlugAllocator
+from .models import Category, Product, ProductImage
+from .tasks import generate_image_variants
+
+PRODUCT_FIELDS = ['title', 'description', 'unit_price', 'inventory']
+UPDATE_FIELDS = PRODUCT_FIELDS + ['category', 'last_update']
+
+
+def read_rows(path, file_format):
+    """
+    Yield ``(line, row)`` from a CSV file (``images`` separated by ``|``)
+    or a JSON Lines file (``images`` as a list).
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                row['images'] = [name for name in (row.get('images') or '').split('|')
+                                 if name]
+                yield reader.line_num, row
+        else:
+            for line, text in enumerate(f, 1):
+                if text.strip():
+                    yield line, json.loads(text)
+
+
+class CatalogImporter:
+    """
+    Creates or updates products in batches. Rows with a ``slug`` that
+    already exists update that product; every other row creates one,
+    with a slug allocated in memory against the slugs loaded up front.
+    A row naming a slug the import allocated to an earlier row is
+    reported rather than replacing that product. Categories are matched
+    by title and created when missing; images are added unless the
+    product already has that file.
+    """
+
+    def __init__(self, generate_variants=True):
+        self.generate_variants = generate_variants
+        self.categories = dict(Category.objects.order_by('-id')
+                               .values_list('title', 'id'))
+        self.products = dict(Product.objects.values_list('slug', 'id'))
+        self.slugs = SlugAllocator(Product._meta.get_field('slug'), self.products)
+        # Slugs this import allocated -> the line they were allocated for
+        self.allocated = {}
+        self.created = self.updated = self.images = 0
+        self.errors = []
+
+    def clean(self, line, row):
+        try:
+            product = {}
+            for name in PRODUCT_FIELDS:
+                field = Product._meta.get_field(name)
+                value = row.get(name)
+                product[name] = field.clean(None if value == '' else value, None)
+            category = (row.get('category') or '').strip()
+            if not category:
+                raise ValidationError({'category': ['This field cannot be blank.']})
+            slug = row.get('slug') or None
+            if slug is not None:
+                validate_slug(slug)
+        except ValidationError as error:
+            self.errors.append((line, '; '.join(error.messages)))
+            return None
+        return {'line': line, 'product': product, 'category': category,
+                'slug': slug, 'images': list(row.get('images') or [])}
+
+    def import_batch(self, rows):
+        cleaned = [item for item in (self.clean(line, row) for line, row in rows)
+                   if item is not None]
+        with transaction.atomic():
+            self.save_categories(cleaned)
+            product_ids = self.save_products(cleaned)
+            image_ids = self.save_images(cleaned, product_ids)
+        if self.generate_variants and image_ids:
+            for image_id in image_ids:
+                generate_image_variants.delay(image_id)
+
+    def save_categories(self, cleaned):
+        missing = {item['category'] for item in cleaned} - set(self.categories)
+        if not missing:
+            return
+        created = Category.objects.bulk_create(
+            Category(title=title) for title in sorted(missing))
+        if any(category.pk is None for category in created):
+            created = Category.objects.filter(title__in=missing)
+        self.categories.update((category.title, category.pk) for category in created)
+
+    def save_products(self, cleaned):
+        # A later row for the same slug wins within a batch, whether the
+        # slug belongs to an existing product or to one the batch creates.
+        updates, creates = {}, {}
+        for item in cleaned:
+            slug = item['slug']
+            if slug in self.allocated:
+                self.errors.append((item['line'], (
+                    f'Slug "{slug}" was allocated to the product on line '
+                    f'{self.allocated[slug]}.')))
+                continue
+            product = Product(category_id=self.categories[item['category']],
+                              **item['product'])
+            if slug in self.products:
+                product.pk, pending = self.products[slug], updates
+            else:
+                if slug is None:
+                    slug = self.slugs.allocate(item['product']['title'])
+                    self.allocated[slug] = item['line']
+                elif slug not in self.slugs.taken:
+                    self.slugs.reserve(slug)
+                # Otherwise an earlier row of this batch named the same
+                # slug; this row replaces its create.
+                product._slug_preallocated, pending = True, creates
+            product.slug = slug
+            if slug in pending:
+                # Images still add up, as they would across batches.
+                item = {**item, 'images': pending[slug][1]['images'] + item['images']}
+            pending[slug] = (product, item)
+
+        creates = list(creates.values())
+        Product.objects.bulk_create([product for product, _ in creates])
+        if any(product.pk is None for product, _ in creates):
+            ids = dict(Product.objects
+                       .filter(slug__in=[product.slug for product, _ in creates])
+                       .values_list('slug', 'id'))
+            for product, _ in creates:
+                product.pk = ids[product.slug]
+        for product, _ in creates:
+            self.products[product.slug] = product.pk
+
+        now = timezone.now()
+        existing = []
+        for product, item in updates.values():
+            product.pk = self.products[product.slug]
+            product.last_update = now
+            existing.append((product, item))
+        Product.objects.bulk_update([product for product, _ in existing], UPDATE_FIELDS)
+
+        self.created += len(creates)
+        self.updated += len(existing)
+        return [(product.pk, item) for product, item in creates + existing]
+
+    def save_images(self, cleaned, product_ids):
+        wanted = {(product_id, name) for product_id, item in product_ids
+                  for name in item['images']}
+        if not wanted:
+            return []
+        existing = set(ProductImage.objects
+                       .filter(product_id__in={product_id for product_id, _ in wanted})
+                       .values_list('product_id', 'image'))
+        created = ProductImage.objects.bulk_create(
+            ProductImage(product_id=product_id, image=name)
+            for product_id, name in sorted(wanted - existing))
+        self.images += len(created)
+        return [image.pk for image in created if image.pk is not None]
@@ -0,0 +1,55 @@
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from .models import Product
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(
+            f'Not enough inventory for products {sorted(product_ids)}')
+
+
+def _per_product(quantities):
+    return Case(
+        *[When(pk=product_id, then=Value(quantity))
+          for product_id, quantity in quantities.items()],
+        output_field=IntegerField())
+
+
+def decrement_stock(quantities):
+    """
+    Take ``{product_id: quantity}`` out of inventory in one guarded UPDATE.
+
+    Rows are only touched when ``inventory >= quantity``, so concurrent
+    checkouts of the same product serialize on the row lock and re-check
+    the guard instead of overselling. If any line is short, nothing is
+    applied and InsufficientStock is raised.
+    """
+    if not quantities:
+        return
+    quantity = _per_product(quantities)
+    with transaction.atomic():
+        updated = Product.objects \
+            .filter(pk__in=sorted(quantities), inventory__gte=quantity) \
+            .update(inventory=F('inventory') - quantity)
+        if updated != len(quantities):
+            transaction.set_rollback(True)
+
+    if updated != len(quantities):
+        available = dict(Product.objects
+                         .filter(pk__in=quantities)
+                         .values_list('pk', 'inventory'))
+        raise InsufficientStock([
+            product_id for product_id, requested in quantities.items()
+            if available.get(product_id, 0) < requested
+        ])
+
+
+def restore_stock(quantities):
+    if not quantities:
+        return
+    quantity = _per_product(quantities)
+    Product.objects \
+        .filter(pk__in=sorted(quantities)) \
+        .update(inventory=F('inventory') + quantity)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Fill Order.total_amount and Order.items_count from the order items.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Recompute every order, not only those without totals.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        orders = Order.objects.all()
+        if not options['all']:
+            orders = orders.filter(items_count=0)
+
+        last_id = orders.aggregate(last_id=Max('id'))['last_id'] or 0
+        updated = 0
+        for start in range(0, last_id, batch_size):
+            updated += orders \
+                .filter(id__gt=start, id__lte=start + batch_size) \
+                .refresh_totals()
+            self.stdout.write(f'Processed orders up to id {start + batch_size}')
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} orders.'))
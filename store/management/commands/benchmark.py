@@ -0,0 +1,118 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from shop.celery import eager_tasks
+from store import benchmark
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway test database and measure throughput, latency '
+            'and SQL query count of the main store endpoints.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--images', type=int, default=2,
+                            help='Images per product.')
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--carts', type=int, default=50)
+        parser.add_argument('--orders', type=int, default=200)
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--concurrency', type=int, metavar='N',
+                            help='Compare the sync views with their async '
+                                 'counterparts through the ASGI handler, N '
+                                 'requests in flight at a time.')
+        parser.add_argument('--only', nargs='+', metavar='SCENARIO',
+                            help='Run only the named scenarios.')
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Disable the catalog response cache.')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Reuse the test database if it exists.')
+        parser.add_argument('--output', help='Write the results as JSON.')
+        parser.add_argument('--compare', metavar='BASELINE',
+                            help='Fail if results regress against this JSON file.')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Allowed relative latency/throughput regression.')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)['results']
+
+        overrides = {
+            'STORE_PAYMENT_GATEWAY': 'store.payments.FakePaymentGateway',
+        }
+        if options['no_cache']:
+            overrides['CACHES'] = {
+                'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+                'catalog': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+            }
+
+        with eager_tasks(), benchmark.test_database(options['keepdb']), \
+                override_settings(**overrides):
+            results = self.run_benchmark(options)
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'vendor': connection.vendor,
+                           'options': {key: options[key] for key in (
+                               'categories', 'products', 'images', 'users',
+                               'carts', 'orders', 'iterations', 'seed',
+                               'no_cache', 'concurrency')},
+                           'results': results}, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if baseline is not None:
+            regressions = list(benchmark.compare(
+                baseline, results, options['tolerance']))
+            for name, metric, before, after in regressions:
+                self.stderr.write(
+                    f'{name}: {metric} regressed from {before:.4g} to {after:.4g}')
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against baseline.')
+            self.stdout.write(self.style.SUCCESS('No regressions against baseline.'))
+
+    def run_benchmark(self, options):
+        if not options['keepdb'] or not Product.objects.exists():
+            self.stdout.write('Seeding...')
+            benchmark.seed(
+                categories=options['categories'], products=options['products'],
+                images=options['images'], users=options['users'],
+                carts=options['carts'], orders=options['orders'],
+                random_seed=options['seed'])
+
+        concurrency = options['concurrency']
+        scenarios = benchmark.asgi_scenarios() if concurrency \
+            else benchmark.default_scenarios()
+        if options['only']:
+            unknown = set(options['only']) - {s.name for s in scenarios}
+            if unknown:
+                raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+            scenarios = [s for s in scenarios if s.name in options['only']]
+
+        results = {}
+        for scenario in scenarios:
+            self.stdout.write(f'Running {scenario.name}...')
+            if concurrency:
+                results[scenario.name] = benchmark.run_concurrent(
+                    scenario, options['iterations'], options['warmup'], concurrency)
+            else:
+                results[scenario.name] = benchmark.run_scenario(
+                    scenario, options['iterations'], options['warmup'])
+        return results
+
+    def report(self, results):
+        self.stdout.write(
+            f'{"scenario":<24}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}'
+            f'{"p99 ms":>10}{"queries":>9}')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<24}{result["throughput"]:>10.1f}{result["p50_ms"]:>10.2f}'
+                f'{result["p95_ms"]:>10.2f}{result["p99_ms"]:>10.2f}'
+                f'{result["queries"]:>9}')
@@ -0,0 +1,78 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from store import benchmark
+from store.models import CartItem, Product
+from store.serializers import CartItemSerializer, ProductRowSerializer, ProductSerializer, SimpleProductSerializer
+
+
+class FieldTreeProductSerializer(serializers.ModelSerializer):
+    # SimpleProductSerializer without the compiled fast path.
+    class Meta:
+        model = Product
+        fields = SimpleProductSerializer.Meta.fields
+
+
+class FieldTreeCartItemSerializer(CartItemSerializer):
+    product = FieldTreeProductSerializer()
+
+
+class Command(BaseCommand):
+    help = ('Compare rows/second of the fast product serializers against the '
+            'DRF field-tree serializers and check their output is identical.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--images', type=int, default=2)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with benchmark.test_database():
+            benchmark.seed(products=options['products'], images=options['images'],
+                           carts=options['products'] // 5, orders=0)
+            request = Request(RequestFactory().get('/store/products/'))
+            context = {'request': request}
+
+            products = Product.objects.select_related('category').prefetch_related('images')
+            rows = Product.objects.values(*ProductRowSerializer.values_fields)
+            self.compare(
+                'ProductSerializer',
+                lambda: ProductSerializer(list(products), many=True, context=context).data,
+                lambda: ProductRowSerializer(list(rows), many=True, context=context).data,
+                options['repeat'])
+
+            items = list(CartItem.objects.select_related('product').with_totals())
+            self.compare(
+                'SimpleProductSerializer (cart items)',
+                lambda: FieldTreeCartItemSerializer(items, many=True).data,
+                lambda: CartItemSerializer(items, many=True).data,
+                options['repeat'])
+
+    def compare(self, name, reference, fast, repeat):
+        expected = JSONRenderer().render(reference())
+        actual = JSONRenderer().render(fast())
+        if expected != actual:
+            raise CommandError(f'{name}: fast output differs from the reference.')
+
+        rows = len(reference())
+        before = self.rows_per_second(reference, rows, repeat)
+        after = self.rows_per_second(fast, rows, repeat)
+        self.stdout.write(
+            f'{name}: {rows} rows, output identical\n'
+            f'  field tree {before:>12,.0f} rows/s\n'
+            f'  fast       {after:>12,.0f} rows/s ({after / before:.1f}x)')
+
+    @staticmethod
+    def rows_per_second(serialize, rows, repeat):
+        # Best of ``repeat`` runs, queries included.
+        best = min(timed(serialize) for _ in range(repeat))
+        return rows / best
+
+
+def timed(serialize):
+    start = time.perf_counter()
+    serialize()
+    return time.perf_counter() - start
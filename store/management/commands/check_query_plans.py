@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from store import benchmark
+from store.query_plans import PLANNERS, check_plans, default_checks
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway test database, request the hot store endpoints '
+            'and fail if their queries plan a full table scan.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--verbose-plans', action='store_true',
+                            help='Print the plan of every checked query.')
+
+    def handle(self, *args, **options):
+        planner_class = PLANNERS.get(connection.vendor)
+        if planner_class is None:
+            raise CommandError(f'No query plan checks for {connection.vendor}.')
+
+        dummy = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+        with benchmark.test_database(), \
+                override_settings(CACHES={'default': dummy, 'catalog': dummy}):
+            benchmark.seed(products=options['products'], orders=options['orders'],
+                           users=50)
+            failures = 0
+            for check, queries in check_plans(planner_class(), default_checks()):
+                check_failures = failures
+                for sql, plan, problems in queries:
+                    if options['verbose_plans'] or problems:
+                        self.stdout.write(f'{check.name}: {sql}')
+                        for line in plan:
+                            self.stdout.write(f'    {line}')
+                    if problems:
+                        failures += 1
+                        self.stderr.write(f'{check.name}: {"; ".join(problems)}')
+                if failures == check_failures:
+                    self.stdout.write(f'{check.name}: ok')
+
+        if failures:
+            raise CommandError(f'{failures} queries are not served by an index.')
+        self.stdout.write(self.style.SUCCESS('All checked queries use an index.'))
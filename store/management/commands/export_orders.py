@@ -0,0 +1,36 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from store.exports import EXPORTERS, export_orders
+from store.filters import OrderExportFilter
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Stream orders with their items as NDJSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='export_format',
+                            choices=list(EXPORTERS), default='ndjson')
+        parser.add_argument('--placed-after', help='ISO 8601, inclusive.')
+        parser.add_argument('--placed-before', help='ISO 8601, exclusive.')
+        parser.add_argument('--payment-status',
+                            choices=[choice for choice, _ in Order.PAYMENT_STATUS_CHOICES])
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--output', '-o', help='File to write; stdout by default.')
+
+    def handle(self, *args, **options):
+        filterset = OrderExportFilter({
+            'placed_after': options['placed_after'],
+            'placed_before': options['placed_before'],
+            'payment_status': options['payment_status'],
+        }, Order.objects.all())
+        if not filterset.is_valid():
+            raise CommandError(filterset.errors.as_text())
+
+        lines = export_orders(filterset.qs, options['export_format'],
+                              options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                f.writelines(lines)
+        else:
+            sys.stdout.buffer.writelines(lines)
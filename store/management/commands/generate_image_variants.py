@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from store.models import ProductImage
+from store.tasks import generate_image_variants
+
+
+class Command(BaseCommand):
+    help = 'Generate resized variants for product images that have none.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Regenerate every image, not only those without variants.')
+        parser.add_argument(
+            '--enqueue', action='store_true',
+            help='Queue a Celery task per image instead of running inline.')
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.exclude(image='')
+        if not options['all']:
+            images = images.filter(variants={})
+
+        count = 0
+        for image_id in images.values_list('id', flat=True).iterator():
+            if options['enqueue']:
+                generate_image_variants.delay(image_id)
+            else:
+                generate_image_variants(image_id)
+            count += 1
+            if count % 100 == 0:
+                self.stdout.write(f'{count} images...')
+
+        verb = 'Queued' if options['enqueue'] else 'Processed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {count} images.'))
@@ -0,0 +1,51 @@
+import time
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from store.imports import CatalogImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = ('Create or update categories, products and images from a CSV or '
+            'JSON Lines file, in batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', dest='file_format', choices=['csv', 'jsonl'],
+                            help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--skip-variants', action='store_true',
+                            help='Do not queue image variant generation.')
+        parser.add_argument('--strict', action='store_true',
+                            help='Fail if any row is invalid.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format'] or \
+            ('csv' if path.endswith('.csv') else 'jsonl')
+
+        importer = CatalogImporter(
+            generate_variants=not options['skip_variants'])
+        rows = read_rows(path, file_format)
+        count = 0
+        start = time.perf_counter()
+        while True:
+            batch = list(islice(rows, options['batch_size']))
+            if not batch:
+                break
+            importer.import_batch(batch)
+            count += len(batch)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{count} rows, {count / elapsed:.0f} rows/s')
+
+        elapsed = time.perf_counter() - start
+        for line, message in importer.errors[:20]:
+            self.stderr.write(f'line {line}: {message}')
+        if len(importer.errors) > 20:
+            self.stderr.write(f'... and {len(importer.errors) - 20} more')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {importer.created} and updated {importer.updated} products, '
+            f'added {importer.images} images in {elapsed:.1f}s '
+            f'({count / max(elapsed, 1e-9):.0f} rows/s); '
+            f'{len(importer.errors)} rows skipped.'))
+        if options['strict'] and importer.errors:
+            raise CommandError(f'{len(importer.errors)} invalid rows.')
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from store.carts import purge_expired_carts
+
+
+class Command(BaseCommand):
+    help = ('Delete database carts with no item activity for STORE_CART_TTL, '
+            'in small batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.STORE_CART_PURGE_BATCH_SIZE,
+                            help='Carts deleted per transaction.')
+        parser.add_argument('--max-batches', type=int,
+                            help='Stop after this many batches.')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between batches.')
+
+    def handle(self, *args, **options):
+        purged = purge_expired_carts(options['batch_size'],
+                                     options['max_batches'], options['pause'])
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} carts.'))
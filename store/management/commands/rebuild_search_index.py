@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from store.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Recreate the product full-text search index and repopulate it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        backend = get_search_backend(connection)
+        if backend is None:
+            raise CommandError(
+                f'No full-text search backend for {connection.vendor}.')
+        backend.install(connection)
+        backend.rebuild(connection)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the product search index on {connection.alias}.'))
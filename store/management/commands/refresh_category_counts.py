@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from store.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Recompute Category.products_count, or verify it with --check.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Report categories whose stored count is wrong without fixing them.')
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            updated = Category.objects.refresh_products_count()
+            self.stdout.write(self.style.SUCCESS(
+                f'Refreshed product counts for {updated} categories.'))
+            return
+
+        mismatched = Category.objects \
+            .annotate(actual_count=Count('products')) \
+            .values_list('id', 'title', 'products_count', 'actual_count')
+        mismatched = [row for row in mismatched if row[2] != row[3]]
+        for id, title, stored, actual in mismatched:
+            self.stdout.write(
+                f'Category {id} ({title}): stored {stored}, actual {actual}')
+        if mismatched:
+            raise CommandError(
+                f'{len(mismatched)} categories have a stale product count.')
+        self.stdout.write(self.style.SUCCESS('All product counts are correct.'))
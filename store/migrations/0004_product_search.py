@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def install_search(apps, schema_editor):
+    from store.search import get_search_backend
+    backend = get_search_backend(schema_editor.connection)
+    if backend is not None:
+        backend.install(schema_editor.connection)
+        backend.rebuild(schema_editor.connection)
+
+
+def uninstall_search(apps, schema_editor):
+    from store.search import get_search_backend
+    backend = get_search_backend(schema_editor.connection)
+    if backend is not None:
+        backend.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_alter_order_customer'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search, uninstall_search),
+    ]
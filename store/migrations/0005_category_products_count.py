@@ -0,0 +1,34 @@
+# Generated by Django 4.1.5 on 2026-10-18 11:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_products_count(apps, schema_editor):
+    Category = apps.get_model('store', 'Category')
+    Product = apps.get_model('store', 'Product')
+    counts = Product.objects \
+        .filter(category=OuterRef('pk')) \
+        .order_by() \
+        .values('category') \
+        .annotate(count=Count('pk')) \
+        .values('count')
+    Category.objects.update(products_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_product_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_products_count,
+                             migrations.RunPython.noop),
+    ]
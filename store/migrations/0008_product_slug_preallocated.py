@@ -0,0 +1,19 @@
+# Generated by Django 4.1.5 on 2026-10-18 11:35
+
+from django.db import migrations
+import store.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_productimage_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='slug',
+            field=store.fields.PreallocatedSlugField(editable=False, populate_from='title', unique=True),
+        ),
+    ]
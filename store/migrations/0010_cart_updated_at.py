@@ -0,0 +1,32 @@
+# Generated by Django 4.1.5 on 2026-10-18 12:09
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def populate_updated_at(apps, schema_editor):
+    # Existing carts have had no tracked activity since they were created.
+    Cart = apps.get_model('store', 'Cart')
+    Cart.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(populate_updated_at,
+                             migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['updated_at'], name='store_cart_updated_idx'),
+        ),
+    ]
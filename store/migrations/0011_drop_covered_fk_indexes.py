@@ -0,0 +1,32 @@
+# Generated by Django 4.1.5 on 2026-10-18 12:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('store', '0010_cart_updated_at'),
+    ]
+
+    # store_order_customer_idx (customer, -placed_at, -id) and
+    # store_product_cat_price_idx (category, unit_price), added in 0009,
+    # lead with these foreign keys, so they serve every lookup and PROTECT
+    # check the single-column indexes did. Dropping the duplicates saves
+    # an index write per order and product insert or move; the
+    # check_query_plans command (and QueryPlanTests) verifies the plans.
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='customer',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='category',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='products', to='store.category'),
+        ),
+    ]
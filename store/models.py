@@ -1,12 +1,100 @@
+from collections import Counter
+from decimal import Decimal
 from uuid import uuid4
-from autoslug import AutoSlugField
+from .fields import PreallocatedSlugField
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import Count, ExpressionWrapper, F, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.utils import timezone
+from .signals import catalog_changed
+
+
+PRICE_TOTAL_FIELD = models.DecimalField(max_digits=12, decimal_places=2)
+
+
+class CatalogQuerySet(models.QuerySet):
+    # Fields written too often to drop the catalog cache for; updates of
+    # only these leave it to turn over (see store.cache.catalog_epoch).
+    volatile_fields = frozenset()
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        if rows and not kwargs.keys() <= self.volatile_fields:
+            catalog_changed.send(sender=self.model, fields=list(kwargs))
+        return rows
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        rows = super().bulk_update(objs, fields, batch_size=batch_size)
+        if rows and not set(fields) <= self.volatile_fields:
+            catalog_changed.send(sender=self.model, fields=list(fields))
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            catalog_changed.send(sender=self.model, objs=objs)
+        return objs
+
+
+class CategoryQuerySet(CatalogQuerySet):
+    def refresh_products_count(self):
+        counts = Product.objects \
+            .filter(category=OuterRef('pk')) \
+            .order_by() \
+            .values('category') \
+            .annotate(count=Count('pk')) \
+            .values('count')
+        return self.update(products_count=Coalesce(Subquery(counts), 0))
+
+
+class ProductQuerySet(CatalogQuerySet):
+    # Every checkout and failed payment moves inventory.
+    volatile_fields = frozenset({'inventory'})
+
+    def update(self, **kwargs):
+        if 'category' not in kwargs and 'category_id' not in kwargs:
+            return super().update(**kwargs)
+
+        with transaction.atomic(using=self.db):
+            affected = set(self.order_by().values_list(
+                'category_id', flat=True).distinct())
+            rows = super().update(**kwargs)
+            category = kwargs.get('category', kwargs.get('category_id'))
+            affected.add(getattr(category, 'pk', category))
+            Category.objects.filter(pk__in=affected).refresh_products_count()
+        return rows
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        if 'category' not in fields and 'category_id' not in fields:
+            return super().bulk_update(objs, fields, batch_size=batch_size)
+
+        with transaction.atomic(using=self.db):
+            affected = set(self.filter(pk__in=[obj.pk for obj in objs])
+                           .order_by()
+                           .values_list('category_id', flat=True)
+                           .distinct())
+            rows = super().bulk_update(objs, fields, batch_size=batch_size)
+            affected.update(obj.category_id for obj in objs)
+            Category.objects.filter(pk__in=affected).refresh_products_count()
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            created = Counter(obj.category_id for obj in objs)
+            for category_id, count in created.items():
+                Category.objects.filter(pk=category_id).update(
+                    products_count=F('products_count') + count)
+        return objs
 
 
 class Category(models.Model):
     title = models.CharField(max_length=255)
+    products_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CategoryQuerySet.as_manager()
 
     def __str__(self) -> str:
         return self.title
@@ -17,8 +105,8 @@ class Category(models.Model):
 
 class Product(models.Model):
     title = models.CharField(max_length=255)
-    slug = AutoSlugField(unique=True, always_update=False,
-                         populate_from="title")
+    slug = PreallocatedSlugField(unique=True, always_update=False,
+                                 populate_from="title")
     description = models.TextField(null=True, blank=True)
     unit_price = models.DecimalField(
         max_digits=6,
@@ -26,14 +114,62 @@ class Product(models.Model):
         validators=[MinValueValidator(1)])
     inventory = models.IntegerField(validators=[MinValueValidator(0)])
     last_update = models.DateTimeField(auto_now=True)
+    # store_product_cat_price_idx leads with category and covers it.
     category = models.ForeignKey(
-        Category, on_delete=models.PROTECT, related_name='products')
+        Category, on_delete=models.PROTECT, related_name='products',
+        db_index=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets the post_save handlers see slug changes.
+        instance._loaded_slug = instance.__dict__.get('slug')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # The products_count handlers adjust the category the row is really
+        # leaving, read under a row lock rather than from a possibly stale
+        # instance, so concurrent moves of one product cannot drift it.
+        using = kwargs.get('using') or router.db_for_write(Product, instance=self)
+        with transaction.atomic(using=using):
+            self._loaded_category_id = None
+            if not self._state.adding:
+                self._loaded_category_id = self.stored_category_id(using)
+            super().save(*args, **kwargs)
+
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(Product, instance=self)
+        with transaction.atomic(using=using):
+            category_id = self.stored_category_id(using)
+            if category_id is None:
+                return 0, {}
+            self.category_id = category_id
+            return super().delete(using=using, keep_parents=keep_parents)
+
+    def stored_category_id(self, using):
+        return Product.objects.using(using).select_for_update() \
+            .filter(pk=self.pk).values_list('category_id', flat=True).first()
 
     def __str__(self) -> str:
         return self.title
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            # ProductFilter: category_id exact + unit_price range
+            models.Index(fields=['category', 'unit_price'],
+                         name='store_product_cat_price_idx'),
+            # Default ordering and the keyset orderings
+            models.Index(fields=['title', 'id'],
+                         name='store_product_title_id_idx'),
+            models.Index(fields=['unit_price', 'id'],
+                         name='store_product_price_id_idx'),
+            # Admin InventoryFilter
+            models.Index(fields=['inventory'], condition=models.Q(inventory__lt=15),
+                         name='store_product_low_stock_idx'),
+        ]
 
 
 class ProductImage(models.Model):
@@ -41,11 +177,49 @@ class ProductImage(models.Model):
         Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(
         upload_to='store/images')
+    # {format: {width: name}}, filled in by the generate_image_variants task
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    objects = CatalogQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets the pre_save handler see a replaced upload.
+        instance._loaded_image = instance.__dict__.get('image')
+        return instance
+
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        total = Sum(F('items__quantity') * F('items__product__unit_price'),
+                    output_field=PRICE_TOTAL_FIELD)
+        items = CartItem.objects.select_related('product').with_totals()
+        return self \
+            .annotate(total_price=Coalesce(total, Value(Decimal(0)),
+                                           output_field=PRICE_TOTAL_FIELD)) \
+            .prefetch_related(Prefetch('items', queryset=items, to_attr='line_items'))
 
 
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Last item activity; carts idle for STORE_CART_TTL are purged.
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    objects = CartQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='store_cart_updated_idx'),
+        ]
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_totals(self):
+        return self.annotate(total_price=ExpressionWrapper(
+            F('quantity') * F('product__unit_price'),
+            output_field=PRICE_TOTAL_FIELD))
 
 
 class CartItem(models.Model):
@@ -56,10 +230,27 @@ class CartItem(models.Model):
         validators=[MinValueValidator(1)]
     )
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = [['cart', 'product']]
 
 
+class OrderQuerySet(models.QuerySet):
+    def refresh_totals(self):
+        totals = OrderItem.objects \
+            .filter(order=OuterRef('pk')) \
+            .order_by() \
+            .values('order')
+        amount = totals.annotate(amount=Sum(
+            F('quantity') * F('unit_price'), output_field=PRICE_TOTAL_FIELD))
+        count = totals.annotate(count=Count('pk'))
+        return self.update(
+            total_amount=Coalesce(Subquery(amount.values('amount')), Value(Decimal(0)),
+                                  output_field=PRICE_TOTAL_FIELD),
+            items_count=Coalesce(Subquery(count.values('count')), 0))
+
+
 class Order(models.Model):
     PENDING = 'P'
     COMPLETE = 'C'
@@ -73,14 +264,29 @@ class Order(models.Model):
     placed_at = models.DateTimeField(auto_now_add=True)
     payment_status = models.CharField(
         max_length=1, choices=PAYMENT_STATUS_CHOICES, default=PENDING)
+    # store_order_customer_idx leads with customer and covers it.
     customer = models.ForeignKey(
-        settings.AUTH_USER_MODEL, null=True, on_delete=models.PROTECT)
+        settings.AUTH_USER_MODEL, null=True, on_delete=models.PROTECT,
+        db_index=False)
+    total_amount = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0)
+    items_count = models.PositiveIntegerField(default=0)
+
+    objects = OrderQuerySet.as_manager()
 
     def __str__(self) -> str:
         return str(self.customer)
 
     class Meta:
         ordering = ['-placed_at']
+        indexes = [
+            # A customer's orders, newest first (keyset adds -id)
+            models.Index(fields=['customer', '-placed_at', '-id'],
+                         name='store_order_customer_idx'),
+            # Staff order list
+            models.Index(fields=['-placed_at', '-id'],
+                         name='store_order_placed_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -1,5 +1,156 @@
-from rest_framework.pagination import PageNumberPagination
+import binascii
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
+
+
+class KeysetPagination(BasePagination):
+    """
+    Seeks past the last row seen instead of using OFFSET, and never
+    counts the result set. Each keyset must end with a unique column.
+    """
+    page_size = 10
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    invalid_cursor_message = 'Invalid cursor'
+    orderings = {}
+    default_ordering = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        ordering = request.query_params.get(self.ordering_query_param)
+        self.keyset = self.orderings.get(
+            ordering, self.orderings[self.default_ordering])
+        position, reverse = self.decode_cursor(request, queryset.model)
+
+        keyset = [self.flip(field) for field in self.keyset] \
+            if reverse else self.keyset
+        queryset = queryset.order_by(*keyset)
+        if position is not None:
+            queryset = queryset.filter(self.seek(keyset, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0]), True)
+
+    def get_position(self, item):
+        position = []
+        for field in self.keyset:
+            name = field.lstrip('-')
+            value = item[name] if isinstance(item, dict) \
+                else getattr(item, name)
+            position.append(value if isinstance(value, int) else str(value))
+        return position
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'p': position, 'r': int(reverse)})
+        cursor = urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, model):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(cursor.encode()))
+            position, reverse = payload['p'], bool(payload['r'])
+            if not isinstance(position, list) or len(position) != len(self.keyset):
+                raise ValueError
+            position = [self.to_python(model, field, value)
+                        for field, value in zip(self.keyset, position)]
+        except (TypeError, ValueError, KeyError, ValidationError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    @staticmethod
+    def to_python(model, field, value):
+        # Keyset columns are never NULL, and seeking past None is an error.
+        if value is None:
+            raise ValueError
+        return model._meta.get_field(field.lstrip('-')).to_python(value)
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def seek(keyset, position):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        condition = Q()
+        equal = Q()
+        for field, value in zip(keyset, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+
+class ProductKeysetPagination(KeysetPagination):
+    orderings = {
+        'title': ['title', 'id'],
+        'unit_price': ['unit_price', 'id'],
+        '-unit_price': ['-unit_price', '-id'],
+    }
+    default_ordering = 'title'
+
+
+class OrderKeysetPagination(KeysetPagination):
+    orderings = {
+        '-placed_at': ['-placed_at', '-id'],
+    }
+    default_ordering = '-placed_at'
+
+
+class KeysetPaginationMixin:
+    """
+    Opt-in keyset pagination: ``?pagination=cursor`` (or any ``cursor``
+    link) switches the view from ``pagination_class`` to
+    ``keyset_pagination_class``.
+    """
+    keyset_pagination_class = None
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if self.keyset_pagination_class is not None and (
+                    params.get('pagination') == 'cursor' or 'cursor' in params):
+                self._paginator = self.keyset_pagination_class()
+        return super().paginator
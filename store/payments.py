@@ -0,0 +1,59 @@
+import stripe
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class PaymentGatewayUnavailable(Exception):
+    pass
+
+
+class StripePaymentGateway:
+    def charge(self, order, amount):
+        stripe.api_key = settings.STRIPE_TEST_SECRET_KEY
+        try:
+            payment_method_card = stripe.PaymentMethod.create(
+                type='card',
+                card={
+                    'number': '4242424242424242',
+                    'exp_month': 12,
+                    'exp_year': 2030,
+                    'cvc': 123,
+                },
+            )
+
+            customer_stripe = stripe.Customer.create(
+                description='Test customer',
+                email='test@example.com',
+                name='Test Customer',
+                phone='+1234567890',
+            )
+            # The idempotency key makes a retried task reuse the first intent
+            payment = stripe.PaymentIntent.create(
+                amount=amount,
+                currency='usd',
+                payment_method=payment_method_card,
+                confirm=True,
+                customer=customer_stripe,
+                error_on_requires_action=True,
+                metadata={
+                    'order_id': order.id
+                },
+                idempotency_key=f'order-{order.id}',
+            )
+        except (stripe.error.APIConnectionError, stripe.error.RateLimitError) as error:
+            raise PaymentGatewayUnavailable(str(error)) from error
+        except stripe.error.CardError:
+            return False
+
+        return payment.status == 'succeeded'
+
+
+class FakePaymentGateway:
+    """Approves every charge without leaving the process."""
+
+    def charge(self, order, amount):
+        return True
+
+
+def get_payment_gateway():
+    return import_string(settings.STORE_PAYMENT_GATEWAY)()
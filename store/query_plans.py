@@ -0,0 +1,144 @@
+import re
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from .models import Category, Product
+
+
+class PlanCheck:
+    """
+    Requests ``path`` and fails if any of its queries that filter or limit
+    rows plans a full scan of one of ``tables``, or sorts to apply a LIMIT
+    unless ``allow_sort`` (an index cannot serve every filter + order).
+    """
+
+    def __init__(self, name, path, data=None, tables=(), user=None, allow_sort=False):
+        self.name = name
+        self.path = path
+        self.data = data or {}
+        self.tables = set(tables)
+        self.user = user
+        self.allow_sort = allow_sort
+
+    def capture(self):
+        client = Client()
+        if self.user is not None:
+            client.force_login(self.user)
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = client.get(self.path, self.data)
+        if response.status_code != 200:
+            raise RuntimeError(f'{self.name}: {self.path} returned {response.status_code}')
+        return [(sql, params) for sql, params in queries if indexable(sql)]
+
+
+def indexable(sql):
+    # Unfiltered aggregates (e.g. a COUNT(*) of the whole table) scan by
+    # definition; only statements that narrow or cap the rows are checked.
+    return sql.lstrip().upper().startswith('SELECT') and (
+        ' WHERE ' in sql or ' LIMIT ' in sql)
+
+
+class Planner:
+    scan = None
+    sort = None
+
+    def problems(self, check, sql, params):
+        plan = self.explain(sql, params)
+        scanned = {match.group(1) for line in plan
+                   for match in [self.scan.search(line)] if match}
+        problems = [f'full scan of {table}'
+                    for table in sorted(scanned & check.tables)]
+        if ' LIMIT ' in sql and not check.allow_sort and \
+                any(self.sort.search(line) for line in plan):
+            problems.append('sorts before applying LIMIT')
+        return problems, plan
+
+
+class SQLitePlanner(Planner):
+    scan = re.compile(r'^SCAN (\S+)(?: AS \S+)?$')
+    sort = re.compile(r'^USE TEMP B-TREE FOR ORDER BY$')
+
+    def prepare(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+
+class PostgresPlanner(Planner):
+    scan = re.compile(r'Seq Scan on (\S+)')
+    sort = re.compile(r'(^|-> +)Sort ')
+
+    def prepare(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            # Seeded tables are small enough that scanning and sorting would
+            # win on cost; this way they only show up when no index fits.
+            cursor.execute('SET enable_seqscan = off')
+            cursor.execute('SET enable_sort = off')
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {sql}', params)
+            return [row[0] for row in cursor.fetchall()]
+
+
+PLANNERS = {
+    'sqlite': SQLitePlanner,
+    'postgresql': PostgresPlanner,
+}
+
+
+def check_plans(planner, checks):
+    """
+    Yield each of ``checks`` with the ``(sql, plan, problems)`` of its
+    checked queries, as explained by ``planner``.
+    """
+    planner.prepare()
+    for check in checks:
+        queries = []
+        for sql, params in check.capture():
+            problems, plan = planner.problems(check, sql, params)
+            queries.append((sql, plan, problems))
+        yield check, queries
+
+
+def default_checks():
+    category_id = Category.objects.order_by('id').values_list('id', flat=True).first()
+    users = get_user_model().objects.filter(username__startswith='benchmark').order_by('id')
+    customer = users.first()
+    staff = users.last()
+    staff.is_staff = staff.is_superuser = True
+    staff.save(update_fields=['is_staff', 'is_superuser'])
+    product = Product.objects.order_by('id').first()
+    return [
+        PlanCheck('products.filter', '/store/products/',
+                  {'category_id': category_id, 'unit_price__gt': 100,
+                   'unit_price__lt': 500}, tables=['store_product'],
+                  allow_sort=True),
+        PlanCheck('products.title', '/store/products/', {'pagination': 'cursor'},
+                  tables=['store_product']),
+        PlanCheck('products.unit_price', '/store/products/',
+                  {'pagination': 'cursor', 'ordering': 'unit_price'},
+                  tables=['store_product']),
+        PlanCheck('products.-unit_price', '/store/products/',
+                  {'pagination': 'cursor', 'ordering': '-unit_price'},
+                  tables=['store_product']),
+        PlanCheck('products.by_slug', f'/store/products/by-slug/{product.slug}/',
+                  tables=['store_product', 'store_productimage']),
+        PlanCheck('orders.customer', '/store/orders/', {'pagination': 'cursor'},
+                  tables=['store_order', 'store_orderitem'], user=customer),
+        PlanCheck('orders.staff', '/store/orders/', {'pagination': 'cursor'},
+                  tables=['store_order', 'store_orderitem'], user=staff),
+        PlanCheck('admin.low_inventory', '/admin/store/product/', {'inventory': '<15'},
+                  tables=['store_product'], user=staff, allow_sort=True),
+    ]
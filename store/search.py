@@ -0,0 +1,127 @@
+from django.db import connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from .models import Product
+
+
+class PostgresSearchBackend:
+    """
+    A generated, weighted ``tsvector`` column on the product table,
+    kept current by PostgreSQL on every write and indexed with GIN.
+    """
+    column = 'search_document'
+    index = 'store_product_search_document_gin'
+    document = (
+        "setweight(to_tsvector('english'::regconfig, coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english'::regconfig, coalesce(description, '')), 'B')"
+    )
+
+    def install(self, connection):
+        table = connection.ops.quote_name(Product._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {self.column} '
+                f'tsvector GENERATED ALWAYS AS ({self.document}) STORED')
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {self.index} '
+                f'ON {table} USING GIN ({self.column})')
+
+    def uninstall(self, connection):
+        table = connection.ops.quote_name(Product._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP INDEX IF EXISTS {self.index}')
+            cursor.execute(
+                f'ALTER TABLE {table} DROP COLUMN IF EXISTS {self.column}')
+
+    def rebuild(self, connection):
+        # The column is generated, so there is nothing to rebuild.
+        pass
+
+    def search(self, queryset, query, connection):
+        column = f'{connection.ops.quote_name(Product._meta.db_table)}.{self.column}'
+        tsquery = "websearch_to_tsquery('english'::regconfig, %s)"
+        return queryset \
+            .filter(RawSQL(f'{column} @@ {tsquery}', [query],
+                           output_field=BooleanField())) \
+            .annotate(search_rank=RawSQL(f'ts_rank({column}, {tsquery})', [query],
+                                         output_field=FloatField()))
+
+
+class SQLiteSearchBackend:
+    """
+    An external-content FTS5 table over the product table, kept in sync
+    by triggers so bulk updates are indexed too.
+    """
+    table = 'store_product_fts'
+
+    def install(self, connection):
+        source = Product._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} '
+                f"USING fts5(title, description, content='{source}', content_rowid='id', "
+                "tokenize='porter unicode61')")
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {self.table}_ai AFTER INSERT ON {source} BEGIN '
+                f'INSERT INTO {self.table}(rowid, title, description) '
+                f'VALUES (new.id, new.title, new.description); END')
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {self.table}_ad AFTER DELETE ON {source} BEGIN '
+                f'INSERT INTO {self.table}({self.table}, rowid, title, description) '
+                f"VALUES ('delete', old.id, old.title, old.description); END")
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {self.table}_au '
+                f'AFTER UPDATE OF title, description ON {source} BEGIN '
+                f'INSERT INTO {self.table}({self.table}, rowid, title, description) '
+                f"VALUES ('delete', old.id, old.title, old.description); "
+                f'INSERT INTO {self.table}(rowid, title, description) '
+                f'VALUES (new.id, new.title, new.description); END')
+
+    def uninstall(self, connection):
+        with connection.cursor() as cursor:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {self.table}_{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def rebuild(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.table}({self.table}) VALUES ('rebuild')")
+
+    def search(self, queryset, query, connection):
+        # Quote every term so user input is never parsed as FTS5 syntax.
+        match = ' '.join('"%s"' % term.replace('"', '""')
+                         for term in query.split())
+        id_column = f'{connection.ops.quote_name(Product._meta.db_table)}."id"'
+        matches = f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s'
+        # bm25() is lower-is-better; title hits weigh more than description.
+        rank = (f'SELECT -bm25({self.table}, 4.0, 1.0) FROM {self.table} '
+                f'WHERE {self.table} MATCH %s AND rowid = {id_column}')
+        return queryset \
+            .filter(RawSQL(f'{id_column} IN ({matches})', [match],
+                           output_field=BooleanField())) \
+            .annotate(search_rank=RawSQL(rank, [match],
+                                         output_field=FloatField()))
+
+
+SEARCH_BACKENDS = {
+    'postgresql': PostgresSearchBackend(),
+    'sqlite': SQLiteSearchBackend(),
+}
+
+
+def get_search_backend(connection):
+    return SEARCH_BACKENDS.get(connection.vendor)
+
+
+def search_products(queryset, query):
+    """
+    Return ``queryset`` narrowed to products matching ``query`` and
+    annotated with ``search_rank``, or None when the database has no
+    full-text backend.
+    """
+    connection = connections[queryset.db]
+    backend = get_search_backend(connection)
+    if backend is None:
+        return None
+    return backend.search(queryset, query, connection)
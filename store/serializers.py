@@ -1,10 +1,14 @@
-import stripe
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from operator import attrgetter, itemgetter
 from django.db import transaction
 from django.contrib.auth import get_user_model
-from django.conf import settings
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
 from .models import Product, Category, ProductImage, Cart, CartItem, Order, OrderItem
-from .signals import order_created
+from .carts import CartNotFound, ProductNotFound, get_cart_store
+from .inventory import InsufficientStock, decrement_stock
+from .tasks import process_order_payment
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -15,10 +19,37 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'products_count']
 
 
+class SrcsetField(serializers.Field):
+    """
+    Renders ProductImage.variants as ``{format: "url 320w, url 640w"}``
+    from the stored names, without touching the files.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        storage = ProductImage._meta.get_field('image').storage
+        request = self.context.get('request', None)
+        srcset = {}
+        for key, names in variants.items():
+            candidates = []
+            for width, name in sorted(names.items(), key=lambda item: int(item[0])):
+                url = storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                candidates.append(f'{url} {width}w')
+            srcset[key] = ', '.join(candidates)
+        return srcset
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
+    srcset = SrcsetField(source='variants')
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'srcset']
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -30,10 +61,111 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'description', 'slug', 'inventory',
                   'unit_price', 'category', 'images']
 
+
+def compile_fields(serializer, reader):
+    """
+    Precompute ``(name, read, to_representation)`` for each field of
+    ``serializer``; ``reader`` turns a field source into a getter.
+    """
+    return [(name, reader(field), field.to_representation)
+            for name, field in serializer.fields.items()]
+
+
+def represent(accessors, obj):
+    # Same contract as Serializer.to_representation for flat fields.
+    ret = OrderedDict()
+    for name, read, to_representation in accessors:
+        value = read(obj)
+        ret[name] = None if value is None else to_representation(value)
+    return ret
+
+
+def row_reader(model):
+    """Read a field's source from a ``.values()`` row of ``model``."""
+    def reader(field):
+        path = field.source.replace('.', '__')
+        if isinstance(field, serializers.FileField):
+            # FileField serializers expect a FieldFile, not the stored name.
+            model_field = model._meta.get_field(path)
+            return lambda row: model_field.attr_class(None, model_field, row[path])
+        return itemgetter(path)
+    return reader
+
+
+class ProductRowListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        rows = list(data)
+        if self.child.images is None:
+            self.child.load_images(rows)
+        return [self.child.to_representation(row) for row in rows]
+
+
+class ProductRowSerializer(serializers.BaseSerializer):
+    """
+    Read-only ProductSerializer over ``Product.objects.values(*fields)``
+    rows. Produces the same output without building a field tree per row;
+    images come from one query grouped by product.
+    """
+    values_fields = ['id', 'title', 'description', 'slug', 'inventory',
+                     'unit_price', 'category__title']
+
+    class Meta:
+        list_serializer_class = ProductRowListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        product = ProductSerializer(context=self._context)
+        self.accessors = [
+            (name, itemgetter('id'), self.get_images) if name == 'images'
+            else (name, read, to_representation)
+            for name, read, to_representation
+            in compile_fields(product, row_reader(Product))
+        ]
+        image = ProductImageSerializer(context=self._context)
+        self.image_accessors = compile_fields(image, row_reader(ProductImage))
+        self.image_fields = [field.source for field in image.fields.values()]
+        self.images = None
+
+    def image_rows(self, rows):
+        return ProductImage.objects \
+            .filter(product_id__in=[row['id'] for row in rows]) \
+            .values('product_id', *self.image_fields)
+
+    def add_image(self, row):
+        self.images[row['product_id']].append(
+            represent(self.image_accessors, row))
+
+    def load_images(self, rows):
+        self.images = defaultdict(list)
+        if rows:
+            for row in self.image_rows(rows):
+                self.add_image(row)
+
+    async def aload_images(self, rows):
+        self.images = defaultdict(list)
+        if rows:
+            async for row in self.image_rows(rows):
+                self.add_image(row)
+
+    def get_images(self, product_id):
+        return self.images[product_id]
+
+    def to_representation(self, row):
+        if self.images is None:
+            self.load_images([row])
+        return represent(self.accessors, row)
+
 # This serializer for cart
 
 
 class SimpleProductSerializer(serializers.ModelSerializer):
+    def to_representation(self, instance):
+        # Nested under carts and orders, so it runs once per line.
+        if not hasattr(self, 'accessors'):
+            self.accessors = compile_fields(
+                self, lambda field: attrgetter(field.source))
+        return represent(self.accessors, instance)
+
     class Meta:
         model = Product
         fields = ['id', 'title', 'unit_price']
@@ -44,7 +176,8 @@ class CartItemSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField()
 
     def get_total_price(self, cart_item: CartItem):
-        return cart_item.quantity * cart_item.product.unit_price
+        # Set by the cart store
+        return cart_item.total_price
 
     class Meta:
         model = CartItem
@@ -53,11 +186,13 @@ class CartItemSerializer(serializers.ModelSerializer):
 
 class CartSerializer(serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
-    items = CartItemSerializer(many=True, read_only=True)
+    items = CartItemSerializer(
+        many=True, read_only=True, source='line_items')
     total_price = serializers.SerializerMethodField()
 
     def get_total_price(self, cart):
-        return sum([item.quantity * item.product.unit_price for item in cart.items.all()])
+        # Set by the cart store
+        return cart.total_price
 
     class Meta:
         model = Cart
@@ -67,43 +202,52 @@ class CartSerializer(serializers.ModelSerializer):
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError(
-                'No product with the given ID was found.')
-        return value
-
     def save(self, **kwargs):
-        cart_id = self.context['cart_id']
-        product_id = self.validated_data['product_id']
-        quantity = self.validated_data['quantity']
-        selected_product = Product.objects.get(pk=product_id)
-        if quantity > selected_product.inventory:
-            raise serializers.ValidationError(
-                "You have entered a quantity that is more than the product's availabe quantity")
-
-        try:
-            cart_item = CartItem.objects.get(
-                cart_id=cart_id, product_id=product_id)
-            if cart_item.quantity+quantity > selected_product.inventory:
-                raise serializers.ValidationError(
-                    "You have entered a quantity that is more than the product's availabe quantity")
-            else:
-                cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data)
+        with self.cart_store_errors():
+            self.instance = get_cart_store().add_item(
+                self.context['cart_id'], self.validated_data['product_id'],
+                self.validated_data['quantity'])
+        return self.instance
 
+    async def asave(self, **kwargs):
+        with self.cart_store_errors():
+            self.instance = await get_cart_store().aadd_item(
+                self.context['cart_id'], self.validated_data['product_id'],
+                self.validated_data['quantity'])
         return self.instance
 
+    @contextmanager
+    def cart_store_errors(self):
+        try:
+            yield
+        except CartNotFound:
+            raise NotFound('No cart with the given ID was found.')
+        except ProductNotFound:
+            raise serializers.ValidationError(
+                {'product_id': ['No product with the given ID was found.']})
+        except InsufficientStock:
+            raise serializers.ValidationError(
+                "You have entered a quantity that is more than the product's availabe quantity")
+
     class Meta:
         model = CartItem
         fields = ['id', 'product_id', 'quantity']
 
 
+class BulkCartItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, max_value=32767)
+
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
+    def update(self, instance, validated_data):
+        item = get_cart_store().update_item(
+            instance.cart_id, instance.id, validated_data['quantity'])
+        if item is None:
+            # Removed, or its cart purged, since the view fetched it.
+            raise NotFound()
+        return item
+
     class Meta:
         model = CartItem
         fields = ['quantity']
@@ -119,10 +263,9 @@ class OrderItemSerializer(serializers.ModelSerializer):
 
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
-    total_price = serializers.SerializerMethodField()
-
-    def get_total_price(self, order):
-        return sum([item.quantity * item.product.unit_price for item in order.items.all()])
+    total_price = serializers.DecimalField(
+        source='total_amount', max_digits=12, decimal_places=2,
+        coerce_to_string=False, read_only=True)
 
     class Meta:
         model = Order
@@ -130,6 +273,17 @@ class OrderSerializer(serializers.ModelSerializer):
                   'payment_status', 'items', 'total_price']
 
 
+class OrderSummarySerializer(serializers.ModelSerializer):
+    total_price = serializers.DecimalField(
+        source='total_amount', max_digits=12, decimal_places=2,
+        coerce_to_string=False, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'customer', 'placed_at',
+                  'payment_status', 'items_count', 'total_price']
+
+
 class UpdateOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
@@ -140,10 +294,11 @@ class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
+        cart_store = get_cart_store()
+        if not cart_store.exists(cart_id):
             raise serializers.ValidationError(
                 'No cart with the given ID was found.')
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
+        if not cart_store.has_items(cart_id):
             raise serializers.ValidationError('The cart is empty.')
         return cart_id
 
@@ -151,9 +306,14 @@ class CreateOrderSerializer(serializers.Serializer):
         with transaction.atomic():
             cart_id = self.validated_data['cart_id']
 
-            # Get the customer and validate their address and phone
-            customer = get_user_model().objects.get(
-                id=self.context['id'])
+            # Validate the customer's address and phone. Token users carry
+            # them as claims; load the row when a claim is missing, since
+            # it may have been filled in or changed after the token was
+            # issued (TokenUserAuthentication drops changed claims).
+            customer = self.context['user']
+            if getattr(customer, 'address', None) is None or \
+                    getattr(customer, 'phone', None) is None:
+                customer = get_user_model().objects.get(id=customer.id)
             if getattr(customer, 'address', None) is None:
                 raise serializers.ValidationError(
                     'Your address should not be empty')
@@ -161,13 +321,23 @@ class CreateOrderSerializer(serializers.Serializer):
                 raise serializers.ValidationError(
                     'Your phone should not be empty')
 
-            # Create the order
-            order = Order.objects.create(customer=customer)
+            # Write the cart through to the relational tables
+            cart_store = get_cart_store()
+            cart_store.flush(cart_id)
+
+            # Get the cart items and create the order with its totals
+            cart_items = list(CartItem.objects
+                              .select_related('product')
+                              .filter(cart_id=cart_id))
+            if not cart_items:
+                # Purged as expired since it was validated.
+                raise serializers.ValidationError('The cart is empty.')
+            order = Order.objects.create(
+                customer_id=customer.id,
+                total_amount=sum(
+                    item.product.unit_price * item.quantity for item in cart_items),
+                items_count=len(cart_items))
 
-            # Get the cart items and create the order items
-            cart_items = CartItem.objects \
-                .select_related('product') \
-                .filter(cart_id=cart_id)
             order_items = [
                 OrderItem(
                     order=order,
@@ -178,56 +348,20 @@ class CreateOrderSerializer(serializers.Serializer):
             ]
             OrderItem.objects.bulk_create(order_items)
 
-            # Calculate the total cost of the
-            total_cost = int(sum(
-                item.unit_price * item.quantity for item in order_items)*100)
-        # Set the Stripe API key
-        stripe.api_key = settings.STRIPE_TEST_SECRET_KEY
-        payment_method_card = stripe.PaymentMethod.create(
-            type='card',
-            card={
-                'number': '4242424242424242',
-                'exp_month': 12,
-                'exp_year': 2030,
-                'cvc': 123,
-            },
-        )
-
-        customer_stripe = stripe.Customer.create(
-            description='Test customer',
-            email='test@example.com',
-            name='Test Customer',
-            phone='+1234567890',
-        )
-        # Create the payment
-        payment = stripe.PaymentIntent.create(
-            amount=total_cost,
-            currency='usd',
-            payment_method=payment_method_card,
-            confirm=True,
-            customer=customer_stripe,
-            error_on_requires_action=True,
-            metadata={
-                'order_id': order.id
-            }
-        )
-
-        # Check if the payment was successful
-        if payment.status == 'succeeded':
-            order.payment_status = Order.COMPLETE
-            order.save()
-            for item in order_items:
-                product = item.product
-                product.inventory -= item.quantity
-                product.save()
-        else:
-            order.payment_status = Order.FAILED
-            order.save()
-
-        # Delete the cart
-        Cart.objects.filter(pk=cart_id).delete()
-
-        # Send a signal that the order has been created
-        order_created.send_robust(self.__class__, order=order)
+            # Reserve the stock; a failed payment puts it back
+            try:
+                decrement_stock(
+                    {item.product_id: item.quantity for item in order_items})
+            except InsufficientStock:
+                raise serializers.ValidationError(
+                    'Some products in your cart are no longer available in the requested quantity.')
+
+            # Delete the cart
+            Cart.objects.filter(pk=cart_id).delete()
+            transaction.on_commit(lambda: cart_store.evict(cart_id))
+
+            # Charge the order in the background once it is committed
+            transaction.on_commit(
+                lambda: process_order_payment.delay(order.id))
 
         return order
@@ -1,3 +1,7 @@
 from django.dispatch import Signal
 
 order_created = Signal()
+
+# Sent for bulk writes that bypass post_save/post_delete
+# (queryset.update, bulk_create, bulk_update).
+catalog_changed = Signal()
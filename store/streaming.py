@@ -0,0 +1,54 @@
+import tempfile
+from itertools import islice
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, StreamingHttpResponse
+from shop.renderers import dumps
+
+# Spooled content beyond this many bytes goes to a temporary file.
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+def streaming_response(request, content, **kwargs):
+    """
+    A StreamingHttpResponse over ``content``, an iterator of bytes.
+
+    Django's ASGI handler iterates streaming responses on the event loop,
+    where a queryset iterator may not query. Under ASGI the content is
+    spooled to a temporary file from the view's thread instead, and the
+    file is streamed.
+    """
+    if not isinstance(request, ASGIRequest):
+        return StreamingHttpResponse(content, **kwargs)
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    for part in content:
+        spool.write(part)
+    spool.seek(0)
+    return FileResponse(spool, **kwargs)
+
+
+class StreamingListMixin:
+    """
+    ``?stream=true`` returns the whole filtered list as one JSON array,
+    serialized and sent ``stream_chunk_size`` rows at a time from a
+    queryset iterator, so memory use does not grow with the result.
+    """
+    stream_chunk_size = 500
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('stream') not in ('1', 'true'):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return streaming_response(
+            request._request, self.stream(queryset), content_type='application/json')
+
+    def stream(self, queryset):
+        rows = queryset.iterator(chunk_size=self.stream_chunk_size)
+        separator = b'['
+        while True:
+            chunk = list(islice(rows, self.stream_chunk_size))
+            if not chunk:
+                break
+            data = self.get_serializer(chunk, many=True).data
+            yield separator + dumps(data)[1:-1]
+            separator = b','
+        yield b']' if separator == b',' else b'[]'
@@ -0,0 +1,61 @@
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from .carts import purge_expired_carts
+from .images import delete_variants, generate_variants
+from .inventory import restore_stock
+from .models import Order, ProductImage
+from .payments import PaymentGatewayUnavailable, get_payment_gateway
+from .signals import order_created
+
+
+@shared_task(bind=True, max_retries=5)
+def process_order_payment(self, order_id):
+    order = Order.objects.get(pk=order_id)
+    if order.payment_status != Order.PENDING:
+        return order.payment_status
+
+    total_cost = int(order.total_amount * 100)
+
+    try:
+        paid = get_payment_gateway().charge(order, total_cost)
+    except PaymentGatewayUnavailable as error:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=error, countdown=2 ** self.request.retries)
+        paid = False
+
+    with transaction.atomic():
+        payment_status = Order.COMPLETE if paid else Order.FAILED
+        # Only the first run to settle the order applies its side effects
+        settled = Order.objects \
+            .filter(pk=order.pk, payment_status=Order.PENDING) \
+            .update(payment_status=payment_status)
+        if settled and not paid:
+            restore_stock(dict(
+                order.items.values_list('product_id', 'quantity')))
+
+    if settled:
+        order.payment_status = payment_status
+        order_created.send_robust(Order, order=order)
+    return payment_status
+
+
+@shared_task
+def generate_image_variants(image_id):
+    image = ProductImage.objects.filter(pk=image_id).first()
+    if image is None or not image.image:
+        return
+    variants = generate_variants(image.image)
+    # The upload may have been replaced while this ran.
+    updated = ProductImage.objects \
+        .filter(pk=image_id, image=image.image.name) \
+        .update(variants=variants)
+    if updated:
+        delete_variants(image.variants, image.image.storage)
+    else:
+        delete_variants(variants, image.image.storage)
+
+
+@shared_task
+def purge_carts():
+    return purge_expired_carts(settings.STORE_CART_PURGE_BATCH_SIZE)
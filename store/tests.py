@@ -1,3 +1,1437 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from base64 import urlsafe_b64encode
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from uuid import uuid4
+from asgiref.sync import sync_to_async
+from celery.result import EagerResult
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from shop.celery import app as celery_app, eager_tasks
+from shop.metrics import registry
+from shop.replicas import ReplicaRouter, reading_replica
+from . import benchmark
+from .cache import CATALOG_SETTLING_KEY, LRUCache, catalog_epoch, get_catalog_cache, get_catalog_version, product_slugs
+from .carts import CartNotFound, DatabaseCartStore, InMemoryCartStore, InMemoryRedis, carts_purged, purge_expired_carts
+from .exports import CSV_HEADER, export_orders
+from .fields import SlugAllocator
+from .inventory import InsufficientStock, decrement_stock, restore_stock
+from .models import Cart, CartItem, Category, Order, OrderItem, Product, ProductImage
+from .management.commands.benchmark_serializers import FieldTreeCartItemSerializer
+from .query_plans import PLANNERS, PlanCheck, check_plans, default_checks
+from .serializers import CartItemSerializer, CreateOrderSerializer, ProductImageSerializer, ProductRowSerializer, ProductSerializer
+from .signals import order_created
+from .tasks import process_order_payment, purge_carts
+from .views import ProductViewSet
 
-# Create your tests here.
+DUMMY_CACHE = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+
+
+def titles(response):
+    data = response.json()
+    rows = data['results'] if isinstance(data, dict) else data
+    return [row['title'] for row in rows]
+
+
+class CatalogCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='Shoes')
+        cls.product = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=10, category=cls.category)
+
+    def setUp(self):
+        get_catalog_cache().clear()
+
+    def test_hits_serve_without_queries(self):
+        detail = f'/store/products/{self.product.pk}/'
+        self.client.get('/store/products/')
+        self.client.get(detail)
+        with self.assertNumQueries(0):
+            self.assertEqual(titles(self.client.get('/store/products/')), ['Red Shoe'])
+            self.assertEqual(self.client.get(detail).json()['title'], 'Red Shoe')
+
+    def test_catalog_writes_invalidate(self):
+        self.client.get('/store/products/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'Blue Shoe'
+            self.product.save()
+        self.assertEqual(titles(self.client.get('/store/products/')), ['Blue Shoe'])
+
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.filter(pk=self.category.pk).update(title='Boots')
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_stock_changes_keep_the_cache(self):
+        self.client.get('/store/products/')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            decrement_stock({self.product.pk: 3})
+            restore_stock({self.product.pk: 1})
+        self.assertEqual(callbacks, [])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/store/products/').json()
+                             ['results'][0]['inventory'], 10)
+
+    def test_conditional_get_answers_before_the_view(self):
+        response = self.client.get('/store/products/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(
+                '/store/products/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.client.get(
+            '/store/products/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_validators_turn_over_with_the_epoch(self):
+        response = self.client.get('/store/products/')
+        with mock.patch('store.cache.catalog_epoch',
+                        return_value=catalog_epoch() + settings.STORE_CATALOG_CACHE_TIMEOUT):
+            later = self.client.get('/store/products/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(later.status_code, 200)
+        self.assertNotEqual(later['ETag'], response['ETag'])
+
+
+class ProductsCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes, cls.hats, cls.bags = (
+            Category.objects.create(title=title) for title in ('Shoes', 'Hats', 'Bags'))
+
+    def create_product(self, category, title='Red Shoe'):
+        return Product.objects.create(
+            title=title, unit_price=10, inventory=10, category=category)
+
+    def assertCounts(self, shoes, hats, bags):
+        counts = dict(Category.objects.values_list('title', 'products_count'))
+        self.assertEqual(counts, {'Shoes': shoes, 'Hats': hats, 'Bags': bags})
+
+    def test_create_move_and_delete(self):
+        product = self.create_product(self.shoes)
+        self.create_product(self.shoes, title='Blue Shoe')
+        self.assertCounts(2, 0, 0)
+
+        product.category = self.hats
+        product.save()
+        self.assertCounts(1, 1, 0)
+
+        product.delete()
+        self.assertCounts(1, 0, 0)
+
+    def test_stale_instances_adjust_the_stored_category(self):
+        product = self.create_product(self.shoes)
+        stale = Product.objects.get(pk=product.pk)
+        product.category = self.hats
+        product.save()
+
+        stale.category = self.bags
+        stale.save()
+        self.assertCounts(0, 0, 1)
+
+        stale = Product.objects.get(pk=product.pk)
+        Product.objects.filter(pk=product.pk).update(category=self.shoes)
+        stale.delete()
+        self.assertCounts(0, 0, 0)
+        self.assertEqual(stale.delete(), (0, {}))
+        self.assertCounts(0, 0, 0)
+
+    def test_queryset_writes(self):
+        Product.objects.bulk_create([
+            Product(title=f'Shoe {i}', slug=f'shoe-{i}', unit_price=10,
+                    inventory=10, category=self.shoes) for i in range(3)])
+        self.assertCounts(3, 0, 0)
+
+        Product.objects.filter(slug='shoe-0').update(category=self.hats)
+        self.assertCounts(2, 1, 0)
+
+        products = list(Product.objects.filter(category=self.shoes))
+        for product in products:
+            product.category = self.bags
+        Product.objects.bulk_update(products, ['category'])
+        self.assertCounts(0, 1, 2)
+
+    def test_refresh_command(self):
+        self.create_product(self.shoes)
+        Category.objects.filter(pk=self.shoes.pk).update(products_count=5)
+
+        with self.assertRaisesMessage(CommandError, '1 categories'):
+            call_command('refresh_category_counts', check=True, stdout=StringIO())
+        call_command('refresh_category_counts', stdout=StringIO())
+        self.assertCounts(1, 0, 0)
+        call_command('refresh_category_counts', check=True, stdout=StringIO())
+
+
+def cursor(position, reverse=False):
+    payload = json.dumps({'p': position, 'r': int(reverse)})
+    return urlsafe_b64encode(payload.encode()).decode()
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Shoes')
+        for index in range(15):
+            Product.objects.create(title=f'Shoe {index:02}', unit_price=index + 1,
+                                   inventory=1, category=category)
+
+    def setUp(self):
+        get_catalog_cache().clear()
+
+    def test_pages_forward_and_back(self):
+        first = self.client.get('/store/products/?pagination=cursor&ordering=-unit_price').json()
+        self.assertNotIn('count', first)
+        self.assertIsNone(first['previous'])
+        self.assertEqual(first['results'][0]['title'], 'Shoe 14')
+        second = self.client.get(first['next']).json()
+        self.assertEqual([row['title'] for row in second['results']],
+                         [f'Shoe {index:02}' for index in range(4, -1, -1)])
+        self.assertIsNone(second['next'])
+        self.assertEqual(self.client.get(second['previous']).json()['results'],
+                         first['results'])
+
+    def test_cursors_that_do_not_decode_are_not_found(self):
+        for value in ['!!', 'bm90IGpzb24=', cursor([1]), cursor({'a': 1}),
+                      urlsafe_b64encode(b'[1, 2]').decode()]:
+            with self.subTest(value):
+                response = self.client.get('/store/products/', {'cursor': value})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+
+    def test_tampered_cursors_are_not_found(self):
+        for position in [[None, None], ['1.0', 'zz'], ['abc', 1], [[1], 1]]:
+            with self.subTest(position):
+                response = self.client.get('/store/products/', {
+                    'cursor': cursor(position), 'ordering': 'unit_price'})
+                self.assertEqual(response.status_code, 404)
+        self.client.force_login(get_user_model().objects.create_user(
+            username='buyer', email='buyer@example.com', password='x'))
+        response = self.client.get('/store/orders/', {'cursor': cursor(['yesterday', 1])})
+        self.assertEqual(response.status_code, 404)
+
+
+class CartTotalsTests(TestCase):
+    """Cart and line totals come from SQL annotations, not Python sums."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Shoes')
+        cls.shoe = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=10, category=category)
+        cls.lace = Product.objects.create(
+            title='Lace', unit_price='2.50', inventory=10, category=category)
+        cls.cart = Cart.objects.create()
+        CartItem.objects.create(cart=cls.cart, product=cls.shoe, quantity=3)
+        CartItem.objects.create(cart=cls.cart, product=cls.lace, quantity=4)
+
+    def line_totals(self, items):
+        return {item['product']['title']: item['total_price'] for item in items}
+
+    def test_cart_read_sums_in_the_database(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/store/carts/{self.cart.pk}/')
+        data = response.json()
+        self.assertEqual(data['total_price'], 40)
+        self.assertEqual(self.line_totals(data['items']), {'Red Shoe': 30, 'Lace': 10})
+
+    def test_item_reads_carry_line_totals(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/store/carts/{self.cart.pk}/items/')
+        self.assertEqual(self.line_totals(response.json()), {'Red Shoe': 30, 'Lace': 10})
+
+        item = self.cart.items.get(product=self.lace)
+        response = self.client.get(f'/store/carts/{self.cart.pk}/items/{item.pk}/')
+        self.assertEqual(response.json()['total_price'], 10)
+
+    def test_empty_cart_totals_zero(self):
+        response = self.client.post('/store/carts/')
+        self.assertEqual(response.json()['total_price'], 0)
+        response = self.client.get(f'/store/carts/{response.json()["id"]}/')
+        self.assertEqual(response.json(), {
+            'id': response.json()['id'], 'items': [], 'total_price': 0})
+
+
+class OrderTotalsTests(TestCase):
+    """Order totals are stored at checkout from the captured prices."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Shoes')
+        cls.shoe = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=10, category=category)
+        cls.user = get_user_model().objects.create_user(
+            username='buyer', email='buyer@example.com', password='x',
+            address='Street 1', phone='+123456789')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def place_order(self, quantity):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.shoe, quantity=quantity)
+        serializer = CreateOrderSerializer(
+            data={'cart_id': cart.pk}, context={'user': self.user})
+        serializer.is_valid(raise_exception=True)
+        with mock.patch('store.serializers.process_order_payment'):
+            return serializer.save()
+
+    def orders(self, **params):
+        data = self.client.get('/store/orders/', params).json()
+        return data['results'] if isinstance(data, dict) else data
+
+    def test_totals_keep_the_price_charged(self):
+        order = self.place_order(3)
+        self.assertEqual((order.total_amount, order.items_count), (30, 1))
+        Product.objects.filter(pk=self.shoe.pk).update(unit_price=99)
+
+        [detail] = self.orders()
+        self.assertEqual(detail['total_price'], 30)
+        self.assertEqual(detail['items'][0]['unit_price'], '10.00')
+
+    def test_summary_reads_no_items(self):
+        self.place_order(1)
+        self.place_order(2)
+        with self.assertNumQueries(3):
+            summary = self.orders(summary='true')
+        self.assertEqual([(row['items_count'], row['total_price']) for row in summary],
+                         [(1, 20), (1, 10)])
+        self.assertNotIn('items', summary[0])
+
+    def test_backfill_command(self):
+        order = self.place_order(2)
+        Order.objects.create(customer=self.user)
+        Order.objects.filter(pk=order.pk).update(total_amount=0, items_count=0)
+
+        call_command('backfill_order_totals', batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            list(Order.objects.order_by('pk').values_list('total_amount', 'items_count')),
+            [(20, 1), (0, 0)])
+
+
+class AddCartItemTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Shoes')
+        cls.shoe = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=5, category=category)
+
+    def setUp(self):
+        self.cart = Cart.objects.create()
+        self.url = f'/store/carts/{self.cart.pk}/items/'
+
+    def add(self, quantity, product_id=None, url=None):
+        return self.client.post(url or self.url, {
+            'product_id': product_id or self.shoe.pk, 'quantity': quantity})
+
+    def test_adds_to_the_existing_line(self):
+        self.assertEqual(self.add(2).status_code, 201)
+        response = self.add(3)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['quantity'], 5)
+        self.assertEqual(list(self.cart.items.values_list('product_id', 'quantity')),
+                         [(self.shoe.pk, 5)])
+
+    def test_errors(self):
+        self.add(4)
+        response = self.add(2)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), [
+            "You have entered a quantity that is more than the product's availabe quantity"])
+        self.assertEqual(self.cart.items.get().quantity, 4)
+
+        response = self.add(1, product_id=self.shoe.pk + 100)
+        self.assertEqual(response.json(), {
+            'product_id': ['No product with the given ID was found.']})
+        response = self.add(1, url=f'/store/carts/{uuid4()}/items/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_adding_to_a_line_is_one_guarded_write(self):
+        self.add(1)
+        with CaptureQueriesContext(connection) as queries:
+            self.add(1)
+        statements = [query['sql'] for query in queries
+                      if 'SAVEPOINT' not in query['sql']]
+        if connection.vendor == 'postgresql':
+            # The upsert also records the cart's activity.
+            self.assertEqual(len(statements), 1, statements)
+            self.assertIn('ON CONFLICT', statements[0])
+            self.assertIn('UPDATE "store_cart" SET "updated_at"', statements[0])
+        else:
+            # The ORM fallback touches the cart first and reads the
+            # updated line back.
+            self.assertEqual(len(statements), 3, statements)
+            self.assertTrue(statements[0].startswith('UPDATE "store_cart" '))
+            self.assertTrue(statements[1].startswith('UPDATE "store_cartitem"'))
+
+
+class ProductRowSerializerTests(TestCase):
+    """The fast serializers must render byte-identical JSON."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Shoes')
+        shoe = Product.objects.create(
+            title='Red Shoe', description='Leather', unit_price='10.50',
+            inventory=3, category=category)
+        Product.objects.create(
+            title='Blue Shoe', unit_price=12, inventory=0, category=category)
+        ProductImage.objects.create(product=shoe, image='store/images/red.jpg')
+        ProductImage.objects.create(
+            product=shoe, image='store/images/red-side.jpg',
+            variants={'webp': {'640': 'store/images/variants/red-side-640.webp',
+                               '320': 'store/images/variants/red-side-320.webp'}})
+        cls.cart = Cart.objects.create()
+        CartItem.objects.create(cart=cls.cart, product=shoe, quantity=2)
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_rows_match_the_model_serializer(self):
+        context = {'request': Request(RequestFactory().get('/store/products/'))}
+        products = Product.objects.select_related('category').prefetch_related('images')
+        rows = Product.objects.values(*ProductRowSerializer.values_fields)
+        expected = self.render(ProductSerializer(products, many=True, context=context).data)
+        with self.assertNumQueries(2):
+            actual = self.render(ProductRowSerializer(rows, many=True, context=context).data)
+        self.assertEqual(actual, expected)
+        self.assertEqual(
+            self.render(ProductRowSerializer(rows[0], context=context).data),
+            self.render(ProductSerializer(products[0], context=context).data))
+
+    def test_list_endpoint_serves_rows(self):
+        get_catalog_cache().clear()
+        response = self.client.get('/store/products/')
+        products = Product.objects.select_related('category').prefetch_related('images')
+        expected = ProductSerializer(
+            products, many=True, context={'request': response.wsgi_request}).data
+        self.assertEqual(response.json()['results'], json.loads(self.render(expected)))
+
+    def test_simple_product_matches_the_field_tree(self):
+        items = list(CartItem.objects.select_related('product').with_totals())
+        self.assertEqual(self.render(CartItemSerializer(items, many=True).data),
+                         self.render(FieldTreeCartItemSerializer(items, many=True).data))
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_evicts_the_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        cache.delete('a')
+        self.assertEqual(list(cache.data), ['c'])
+
+
+@override_settings(CACHES={'default': DUMMY_CACHE, 'catalog': DUMMY_CACHE})
+class ProductSlugTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Shoes')
+        cls.shoe = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=3, category=category)
+        cls.boot = Product.objects.create(
+            title='Boot', unit_price=20, inventory=3, category=category)
+
+    def setUp(self):
+        product_slugs.clear()
+        self.addCleanup(product_slugs.clear)
+
+    def get(self, slug):
+        return self.client.get(f'/store/products/by-slug/{slug}/')
+
+    def test_lookup_fills_the_cache(self):
+        self.assertEqual(self.get('red-shoe').json()['id'], self.shoe.pk)
+        self.assertEqual(product_slugs.get('red-shoe'), self.shoe.pk)
+        # The product by primary key, then its images.
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get('red-shoe').json()['id'], self.shoe.pk)
+        self.assertEqual(self.get('blue-shoe').status_code, 404)
+
+    def test_stale_entries_are_corrected(self):
+        product_slugs.set('red-shoe', self.boot.pk)
+        self.assertEqual(self.get('red-shoe').json()['id'], self.shoe.pk)
+        self.assertEqual(product_slugs.get('red-shoe'), self.shoe.pk)
+
+    def test_reslug_and_delete_evict(self):
+        self.get('red-shoe')
+        shoe = Product.objects.get(pk=self.shoe.pk)
+        shoe.slug = 'crimson-shoe'
+        shoe.save()
+        self.assertIsNone(product_slugs.get('red-shoe'))
+        self.assertEqual(self.get('red-shoe').status_code, 404)
+        self.assertEqual(self.get('crimson-shoe').json()['id'], self.shoe.pk)
+
+        self.get('boot')
+        Product.objects.filter(pk=self.boot.pk).update(slug='tall-boot')
+        self.assertIsNone(product_slugs.get('boot'))
+
+        shoe.delete()
+        self.assertIsNone(product_slugs.get('crimson-shoe'))
+
+
+def upload(name, width, height, mode='RGBA'):
+    buffer = BytesIO()
+    Image.new(mode, (width, height), 'red').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(STORE_IMAGE_VARIANT_WIDTHS=[320, 640, 1280])
+class ImageVariantTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Shoes')
+        cls.shoe = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=3, category=category)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def save(self, image):
+        with eager_tasks(), self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        image.refresh_from_db()
+        return image
+
+    def variant_sizes(self, image):
+        storage = image.image.storage
+        sizes = {}
+        for key, names in image.variants.items():
+            for width, name in names.items():
+                with storage.open(name) as f:
+                    sizes[key, width] = Image.open(f).size
+        return sizes
+
+    def test_upload_generates_downscaled_variants(self):
+        image = self.save(ProductImage(product=self.shoe, image=upload('red.png', 800, 400)))
+        self.assertEqual(self.variant_sizes(image), {
+            ('webp', '320'): (320, 160), ('webp', '640'): (640, 320),
+            ('jpeg', '320'): (320, 160), ('jpeg', '640'): (640, 320)})
+
+        small = self.save(ProductImage(product=self.shoe, image=upload('dot.png', 100, 50, 'L')))
+        self.assertEqual(set(self.variant_sizes(small)),
+                         {('webp', '100'), ('jpeg', '100')})
+
+    def test_replaced_and_deleted_uploads_drop_their_variants(self):
+        image = self.save(ProductImage(product=self.shoe, image=upload('red.png', 400, 400)))
+        storage = image.image.storage
+        stale = [name for names in image.variants.values() for name in names.values()]
+
+        image.image = upload('blue.png', 700, 350)
+        image = self.save(image)
+        self.assertFalse(any(storage.exists(name) for name in stale))
+        self.assertEqual(set(image.variants['jpeg']), {'320', '640'})
+
+        current = [name for names in image.variants.values() for name in names.values()]
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertFalse(any(storage.exists(name) for name in current))
+
+    def test_srcset_and_backfill(self):
+        image = ProductImage(product=self.shoe, image=upload('red.png', 700, 350))
+        with mock.patch('store.handlers.generate_image_variants'):
+            image = self.save(image)
+        self.assertEqual(image.variants, {})
+
+        call_command('generate_image_variants', stdout=StringIO())
+        image.refresh_from_db()
+        srcset = ProductImageSerializer(image).data['srcset']
+        self.assertEqual(srcset['webp'], ', '.join(
+            f'{image.image.storage.url(image.variants["webp"][width])} {width}w'
+            for width in ('320', '640')))
+
+
+@override_settings(CACHES={'default': DUMMY_CACHE, 'catalog': DUMMY_CACHE})
+@mock.patch.object(ProductViewSet, 'stream_chunk_size', 2)
+class StreamingListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Shoes')
+        for index in range(5):
+            Product.objects.create(title=f'Shoe {index}', unit_price=10 + index,
+                                   inventory=1, category=category)
+
+    def paged(self, **params):
+        return self.client.get('/store/products/', {'page_size': 100, **params}).json()['results']
+
+    def test_stream_returns_the_whole_list(self):
+        response = self.client.get('/store/products/', {'stream': 'true', 'unit_price__gt': 11})
+        self.assertTrue(response.streaming)
+        rows = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([row['title'] for row in rows], ['Shoe 2', 'Shoe 3', 'Shoe 4'])
+        self.assertEqual(rows, self.paged(unit_price__gt=11))
+
+    def test_empty_stream(self):
+        response = self.client.get('/store/products/', {'stream': 'true', 'unit_price__gt': 99})
+        self.assertEqual(b''.join(response.streaming_content), b'[]')
+
+    async def test_stream_under_asgi(self):
+        response = await self.async_client.get('/store/products/', {'stream': 'true'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        # The ASGI handler reads the content on the event loop.
+        rows = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(rows), 5)
+
+
+class OrderExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.staff = User.objects.create_user(
+            username='staff', email='staff@example.com', password='x', is_staff=True)
+        cls.customer = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='x')
+        category = Category.objects.create(title='Shoes')
+        shoe = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=10, category=category)
+        lace = Product.objects.create(
+            title='Lace, long', unit_price='2.50', inventory=10, category=category)
+        cls.orders = []
+        for month, status, items in [(1, Order.COMPLETE, [(shoe, 2), (lace, 1)]),
+                                     (2, Order.FAILED, []),
+                                     (3, Order.PENDING, [(lace, 4)])]:
+            order = Order.objects.create(customer=cls.customer, payment_status=status)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=quantity,
+                          unit_price=product.unit_price)
+                for product, quantity in items])
+            Order.objects.filter(pk=order.pk).update(
+                placed_at=datetime(2023, month, 1, tzinfo=dt_timezone.utc))
+            cls.orders.append(order)
+        Order.objects.refresh_totals()
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def export(self, **params):
+        return self.client.get('/store/orders/export/', params)
+
+    def ndjson(self, response):
+        return [json.loads(line) for line in
+                b''.join(response.streaming_content).splitlines()]
+
+    def test_ndjson(self):
+        response = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="orders.ndjson"')
+        first, second, third = self.ndjson(response)
+        self.assertEqual(first, {
+            'id': self.orders[0].pk, 'customer': self.customer.pk,
+            'placed_at': '2023-01-01T00:00:00+00:00', 'payment_status': 'C',
+            'total_price': '22.50', 'items_count': 2,
+            'items': [
+                {'product_id': first['items'][0]['product_id'], 'product_title': 'Red Shoe',
+                 'quantity': 2, 'unit_price': '10.00'},
+                {'product_id': first['items'][1]['product_id'], 'product_title': 'Lace, long',
+                 'quantity': 1, 'unit_price': '2.50'}]})
+        self.assertEqual((second['items'], third['total_price']), ([], '10.00'))
+
+    def test_csv(self):
+        response = self.export(export_format='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], CSV_HEADER)
+        first, second, third = (str(order.pk) for order in self.orders)
+        self.assertEqual([row[0] for row in rows[1:]], [first, first, second, third])
+        self.assertEqual(rows[2][7:], ['Lace, long', '1', '2.50'])
+        self.assertEqual(rows[3][4:], ['0.00', '0', '', '', '', ''])
+
+    def test_chunks_read_items_once_per_chunk(self):
+        expected = b''.join(export_orders(Order.objects.all(), 'ndjson'))
+        with self.assertNumQueries(3):
+            self.assertEqual(
+                b''.join(export_orders(Order.objects.all(), 'ndjson', chunk_size=2)), expected)
+
+    def test_filters(self):
+        ids = lambda response: [order['id'] for order in self.ndjson(response)]
+        self.assertEqual(ids(self.export(placed_after='2023-02-01T00:00:00Z',
+                                         placed_before='2023-03-01T00:00:00Z')),
+                         [self.orders[1].pk])
+        self.assertEqual(ids(self.export(payment_status='P')), [self.orders[2].pk])
+        self.assertEqual(self.export(placed_after='yesterday').status_code, 400)
+
+    def test_format_and_permissions(self):
+        response = self.export(export_format='xml')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'export_format': ['Choose one of: ndjson, csv.']})
+        self.client.force_login(self.customer)
+        self.assertEqual(self.export().status_code, 403)
+
+    def test_command(self):
+        output = os.path.join(tempfile.mkdtemp(), 'orders.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        call_command('export_orders', export_format='csv', payment_status='C', output=output)
+        with open(output, newline='') as f:
+            self.assertEqual(len(list(csv.reader(f))), 3)
+
+    async def test_export_under_asgi(self):
+        await sync_to_async(self.async_client.force_login)(self.staff)
+        response = await self.async_client.get('/store/orders/export/')
+        self.assertEqual(len(self.ndjson(response)), 3)
+
+
+class SlugAllocatorTests(SimpleTestCase):
+    def test_allocates_like_autoslugfield(self):
+        field = Product._meta.get_field('slug')
+        slugs = SlugAllocator(field, ['red-shoe', 'red-shoe-2', 'red-shoe-4'])
+        self.assertEqual([slugs.allocate('Red Shoe') for _ in range(3)],
+                         ['red-shoe-3', 'red-shoe-5', 'red-shoe-6'])
+        self.assertEqual(slugs.allocate('Blue Shoe'), 'blue-shoe')
+        self.assertEqual(slugs.allocate('!!!'), 'product')
+        slugs.reserve('hat')
+        self.assertEqual(slugs.allocate('Hat'), 'hat-2')
+
+        long = slugs.allocate('x' * 300), slugs.allocate('x' * 300)
+        self.assertEqual([len(slug) for slug in long], [field.max_length] * 2)
+        self.assertTrue(long[1].endswith('x-2'))
+
+
+class CatalogImportTests(TestCase):
+    header = 'title,slug,description,unit_price,inventory,category,images\n'
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Shoes')
+        cls.shoe = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=1, category=category)
+        ProductImage.objects.create(product=cls.shoe, image='store/images/red.jpg')
+
+    def run_import(self, lines, *args):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'catalog.csv')
+        with open(path, 'w') as f:
+            f.write(self.header + ''.join(line + '\n' for line in lines))
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_catalog', path, '--skip-variants', *args,
+                     stdout=stdout, stderr=stderr)
+        return stderr.getvalue()
+
+    def products(self):
+        return {product.slug: (product.title, product.unit_price, product.category.title,
+                               sorted(image.image.name for image in product.images.all()))
+                for product in Product.objects.select_related('category')}
+
+    def test_creates_and_updates(self):
+        self.run_import([
+            'Red Shoe,,,12,5,Shoes,',
+            'Red Shoe,,,13,5,Shoes,a.jpg|b.jpg',
+            'Boot,red-shoe,,15,2,Shoes,store/images/red.jpg|c.jpg',
+            'Hat,,,5,1,Hats,',
+        ])
+        self.assertEqual(self.products(), {
+            'red-shoe': ('Boot', 15, 'Shoes', ['c.jpg', 'store/images/red.jpg']),
+            'red-shoe-2': ('Red Shoe', 12, 'Shoes', []),
+            'red-shoe-3': ('Red Shoe', 13, 'Shoes', ['a.jpg', 'b.jpg']),
+            'hat': ('Hat', 5, 'Hats', []),
+        })
+        self.assertEqual(Category.objects.get(title='Hats').products_count, 1)
+
+    def test_later_rows_for_a_slug_win(self):
+        self.run_import([
+            'Boot,boot,,15,2,Shoes,a.jpg',
+            'Tall Boot,boot,,16,2,Shoes,b.jpg',
+            'Shoe,red-shoe,,11,1,Shoes,',
+            'Shoe,red-shoe,,12,1,Shoes,',
+        ])
+        products = self.products()
+        self.assertEqual(products['boot'], ('Tall Boot', 16, 'Shoes', ['a.jpg', 'b.jpg']))
+        self.assertEqual(products['red-shoe'][:2], ('Shoe', 12))
+
+    def test_allocated_slugs_are_not_overwritten(self):
+        for batch_size in ('2000', '1'):
+            with self.subTest(batch_size=batch_size):
+                Product.objects.exclude(pk=self.shoe.pk).delete()
+                errors = self.run_import([
+                    'Red Shoe,,,12,5,Shoes,',
+                    'Boot,red-shoe-2,,15,2,Shoes,',
+                ], '--batch-size', batch_size)
+                self.assertEqual(self.products()['red-shoe-2'][:2], ('Red Shoe', 12))
+                self.assertEqual(errors, 'line 3: Slug "red-shoe-2" was allocated '
+                                         'to the product on line 2.\n')
+
+    def test_invalid_rows(self):
+        lines = ['Boot,,,abc,2,Shoes,', 'Hat,bad slug,,5,1,Hats,', 'Cap,,,5,1,,', 'Sock,,,3,1,Socks,']
+        errors = self.run_import(lines)
+        self.assertEqual([line.split(':')[0] for line in errors.splitlines()],
+                         ['line 2', 'line 3', 'line 4'])
+        self.assertIn('sock', self.products())
+        with self.assertRaisesMessage(CommandError, '3 invalid rows.'):
+            self.run_import(lines, '--strict')
+
+
+class AsyncViewTests(TestCase):
+    """The /store/async/ views answer exactly like their sync counterparts."""
+
+    @classmethod
+    def setUpTestData(cls):
+        shoes = Category.objects.create(title='Shoes')
+        hats = Category.objects.create(title='Hats')
+        for index in range(12):
+            product = Product.objects.create(
+                title=f'Shoe {index:02}', description='Leather' if index % 2 else None,
+                unit_price=10 + index, inventory=index, category=shoes if index < 9 else hats)
+            ProductImage.objects.create(product=product, image=f'store/images/{index}.jpg')
+        cls.product = product
+        cls.cart = Cart.objects.create()
+        CartItem.objects.create(cart=cls.cart, product=cls.product, quantity=2)
+
+    def setUp(self):
+        get_catalog_cache().clear()
+
+    async def compare(self, path, data=None, method='get', **extra):
+        if method == 'post':
+            # The 4.1 AsyncClient cannot feed a multipart body to the view.
+            extra['content_type'] = 'application/json'
+        sync_response = await sync_to_async(getattr(self.client, method))(path, data, **extra)
+        async_response = await getattr(self.async_client, method)(f'/store/async{path[6:]}', data, **extra)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        # Page links point back at the view that served them.
+        content = async_response.content.replace(b'/store/async/', b'/store/')
+        self.assertEqual(json.loads(content), sync_response.json())
+        return sync_response.json()
+
+    async def test_product_list(self):
+        category = await Category.objects.aget(title='Hats')
+        for params in [{}, {'page': 2}, {'page_size': 5, 'page': 3},
+                       {'category_id': category.pk}, {'unit_price__gt': 15, 'ordering': '-unit_price'},
+                       {'search': 'Leather'}, {'pagination': 'cursor', 'ordering': 'unit_price'},
+                       {'page': 99}, {'category_id': 'x'}]:
+            with self.subTest(**params):
+                await self.compare('/store/products/', params)
+
+        first = await self.compare('/store/products/', {'pagination': 'cursor'})
+        next_page = first['next'].split('?')[1]
+        await self.compare(f'/store/products/?{next_page}')
+
+    async def test_product_detail_and_categories(self):
+        for pk in [self.product.pk, 9999, 'abc']:
+            with self.subTest(pk=pk):
+                await self.compare(f'/store/products/{pk}/')
+        await self.compare('/store/category/')
+        await self.compare('/store/products/', {'title': 'Hat'}, method='post')
+
+    async def test_carts(self):
+        await self.compare(f'/store/carts/{self.cart.pk}/')
+        await self.compare(f'/store/carts/{uuid4()}/')
+        await self.compare('/store/carts/not-a-uuid/')
+
+        for data in [{'product_id': self.product.pk, 'quantity': 20},
+                     {'product_id': 9999, 'quantity': 1},
+                     {'product_id': self.product.pk}]:
+            with self.subTest(**data):
+                await self.compare(f'/store/carts/{self.cart.pk}/items/', data, method='post')
+
+        data = {'product_id': self.product.pk, 'quantity': 1}
+        await self.compare(f'/store/carts/{uuid4()}/items/', data, method='post')
+        # Each add changes the line, so add to the same line of two carts.
+        other = await Cart.objects.acreate()
+        await CartItem.objects.acreate(cart=other, product=self.product, quantity=2)
+        sync_response = await sync_to_async(self.client.post)(
+            f'/store/carts/{self.cart.pk}/items/', data, content_type='application/json')
+        async_response = await self.async_client.post(
+            f'/store/async/carts/{other.pk}/items/', data, content_type='application/json')
+        self.assertEqual((async_response.status_code, sync_response.status_code), (201, 201))
+        added = [response.json() for response in (sync_response, async_response)]
+        self.assertEqual([{**item, 'id': None} for item in added],
+                         [{'id': None, 'product_id': self.product.pk, 'quantity': 3}] * 2)
+
+
+def run_concurrently(target, count):
+    """
+    Call ``target(index)`` from ``count`` threads released together and
+    return what each call returned or raised, in index order.
+    """
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(index):
+        try:
+            barrier.wait()
+            results[index] = target(index)
+        except Exception as exc:
+            results[index] = exc
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class StockReservationTests(TransactionTestCase):
+    stock = 10
+    buyers = 25
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and \
+                connection.creation.is_in_memory_db(connection.settings_dict['NAME']):
+            self.skipTest('In-memory SQLite databases cannot take concurrent writes.')
+        category = Category.objects.create(title='Shoes')
+        self.product = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=self.stock, category=category)
+
+    def assertSoldOut(self, reserved, refused):
+        self.assertEqual(len(reserved), self.stock)
+        self.assertEqual(len(reserved) + len(refused), self.buyers)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.inventory, 0)
+
+    def test_concurrent_decrements_do_not_oversell(self):
+        def reserve(index):
+            decrement_stock({self.product.pk: 1})
+            return True
+
+        results = run_concurrently(reserve, self.buyers)
+        self.assertSoldOut(
+            [result for result in results if result is True],
+            [result for result in results if isinstance(result, InsufficientStock)])
+
+    @mock.patch('store.serializers.process_order_payment')
+    def test_concurrent_checkouts_do_not_oversell(self, process_order_payment):
+        users, carts = [], []
+        for index in range(self.buyers):
+            users.append(get_user_model().objects.create_user(
+                username=f'buyer{index}', email=f'buyer{index}@example.com',
+                password='x', address='Street 1', phone='+123456789'))
+            cart = Cart.objects.create()
+            CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+            carts.append(cart)
+
+        def checkout(index):
+            serializer = CreateOrderSerializer(
+                data={'cart_id': carts[index].pk}, context={'user': users[index]})
+            serializer.is_valid(raise_exception=True)
+            return serializer.save()
+
+        results = run_concurrently(checkout, self.buyers)
+        orders = [result for result in results if isinstance(result, Order)]
+        self.assertSoldOut(orders, [
+            result for result in results
+            if isinstance(result, ValidationError) and 'no longer available' in str(result)])
+        # Refused checkouts roll back their order and keep their cart.
+        self.assertEqual(Order.objects.count(), self.stock)
+        self.assertEqual(Cart.objects.count(), self.buyers - self.stock)
+        self.assertEqual(process_order_payment.delay.call_count, self.stock)
+
+
+@override_settings(STORE_PAYMENT_GATEWAY='store.payments.FakePaymentGateway')
+class CheckoutTests(TestCase):
+    """Checkout commits a pending order; the payment task settles it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Shoes')
+        cls.product = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=5, category=category)
+        cls.user = get_user_model().objects.create_user(
+            username='buyer', email='buyer@example.com', password='x',
+            address='Street 1', phone='+123456789')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.cart_id = self.client.post('/store/carts/').json()['id']
+        response = self.client.post(f'/store/carts/{self.cart_id}/items/', {
+            'product_id': self.product.pk, 'quantity': 2})
+        self.assertEqual(response.status_code, 201)
+
+    def checkout(self):
+        with eager_tasks(), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/store/orders/', {'cart_id': self.cart_id})
+        self.assertEqual(response.status_code, 200, response.content)
+        return Order.objects.get(pk=response.json()['id'])
+
+    def test_paid_order_keeps_the_stock(self):
+        receiver = mock.Mock()
+        order_created.connect(receiver)
+        self.addCleanup(order_created.disconnect, receiver)
+
+        order = self.checkout()
+        self.assertEqual(order.payment_status, Order.COMPLETE)
+        self.assertEqual(order.total_amount, 20)
+        self.assertEqual(list(order.items.values_list('product_id', 'quantity')),
+                         [(self.product.pk, 2)])
+        self.assertFalse(Cart.objects.filter(pk=self.cart_id).exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.inventory, 3)
+        receiver.assert_called_once_with(
+            signal=order_created, sender=Order, order=order)
+
+    @mock.patch('store.payments.FakePaymentGateway.charge', return_value=False)
+    def test_failed_payment_restores_the_stock(self, charge):
+        order = self.checkout()
+        charge.assert_called_once_with(order, 2000)
+        self.assertEqual(order.payment_status, Order.FAILED)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.inventory, 5)
+
+        # A repeated run leaves the settled order alone.
+        with eager_tasks():
+            self.assertEqual(process_order_payment.delay(order.pk).get(), Order.FAILED)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.inventory, 5)
+
+
+class EagerTasksTests(TestCase):
+    def test_eager_tasks_overrides_the_configured_mode(self):
+        previous = celery_app.conf.get('CELERY_TASK_ALWAYS_EAGER')
+        celery_app.conf['CELERY_TASK_ALWAYS_EAGER'] = False
+        try:
+            with eager_tasks():
+                result = purge_carts.delay()
+            self.assertIsInstance(result, EagerResult)
+            self.assertEqual(result.get(), 0)
+            self.assertIs(celery_app.conf.task_always_eager, False)
+        finally:
+            celery_app.conf['CELERY_TASK_ALWAYS_EAGER'] = previous
+
+
+class CartBulkRaceTests(TransactionTestCase):
+    writers = 10
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and \
+                connection.creation.is_in_memory_db(connection.settings_dict['NAME']):
+            self.skipTest('In-memory SQLite databases cannot take concurrent writes.')
+        category = Category.objects.create(title='Shoes')
+        self.product = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=self.writers, category=category)
+        self.cart = Cart.objects.create()
+
+    def test_concurrent_bulk_writes_of_one_line(self):
+        store = DatabaseCartStore()
+        results = run_concurrently(
+            lambda index: store.set_quantities(self.cart.pk, {self.product.pk: index + 1}),
+            self.writers)
+        self.assertEqual(results, [{}] * self.writers)
+        item = CartItem.objects.get(cart=self.cart)
+        self.assertIn(item.quantity, range(1, self.writers + 1))
+
+
+@skipUnless(connection.vendor in PLANNERS, f'No query plan checks for {connection.vendor}.')
+@override_settings(CACHES={'default': DUMMY_CACHE, 'catalog': DUMMY_CACHE})
+class QueryPlanTests(TestCase):
+    """The check_query_plans checks: hot endpoints must not scan or sort."""
+
+    @classmethod
+    def setUpTestData(cls):
+        benchmark.seed(products=2000, orders=1000, users=50)
+
+    def test_planner_reports_scans_and_sorts(self):
+        planner = PLANNERS[connection.vendor]()
+        planner.prepare()
+        check = PlanCheck('scan', '/', tables=['store_product'])
+        problems, plan = planner.problems(
+            check, 'SELECT id FROM store_product WHERE description = %s '
+                   'ORDER BY last_update LIMIT 5', ['Leather'])
+        self.assertEqual(problems, ['full scan of store_product',
+                                    'sorts before applying LIMIT'], plan)
+
+    def test_hot_queries_use_an_index(self):
+        for check, queries in check_plans(PLANNERS[connection.vendor](), default_checks()):
+            for sql, plan, problems in queries:
+                with self.subTest(check.name, sql=sql):
+                    self.assertEqual(problems, [], '\n'.join(plan))
+
+
+def idle_cart(days):
+    return Cart.objects.create(updated_at=timezone.now() - timedelta(days=days))
+
+
+class CartPurgeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Shoes')
+        cls.product = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=10, category=category)
+
+    def test_purges_idle_carts_oldest_first_in_batches(self):
+        expired = [idle_cart(days) for days in (12, 11, 10, 9, 8)]
+        fresh = [idle_cart(1), Cart.objects.create()]
+        CartItem.objects.create(cart=expired[0], product=self.product, quantity=1)
+
+        self.assertEqual(purge_expired_carts(batch_size=2, max_batches=2), 4)
+        self.assertQuerysetEqual(Cart.objects.order_by('updated_at'),
+                                 [expired[-1]] + fresh)
+        self.assertFalse(CartItem.objects.exists())
+
+        self.assertEqual(purge_expired_carts(batch_size=2), 1)
+        self.assertQuerysetEqual(Cart.objects.order_by('updated_at'), fresh)
+        self.assertEqual(purge_expired_carts(batch_size=2), 0)
+
+    def test_item_activity_restarts_the_clock(self):
+        store = DatabaseCartStore()
+        cart = idle_cart(8)
+        store.add_item(cart.pk, self.product.pk, 1)
+        self.assertEqual(purge_expired_carts(), 0)
+
+        Cart.objects.filter(pk=cart.pk).update(
+            updated_at=timezone.now() - timedelta(days=8))
+        self.assertEqual(purge_expired_carts(), 1)
+
+    def test_edits_record_activity_once_per_interval(self):
+        store = DatabaseCartStore()
+        cart = Cart.objects.create()
+        item = store.add_item(cart.pk, self.product.pk, 1)
+        touched = Cart.objects.get(pk=cart.pk).updated_at
+        with self.assertNumQueries(1):
+            store.mark_active(cart.pk)
+        store.update_item(cart.pk, item.pk, 2)
+        self.assertEqual(Cart.objects.get(pk=cart.pk).updated_at, touched)
+
+        idle = timezone.now() - timedelta(seconds=settings.STORE_CART_TOUCH_INTERVAL + 1)
+        Cart.objects.filter(pk=cart.pk).update(updated_at=idle)
+        store.update_item(cart.pk, item.pk, 3)
+        self.assertGreater(Cart.objects.get(pk=cart.pk).updated_at, idle)
+
+        Cart.objects.filter(pk=cart.pk).update(updated_at=idle)
+        store.remove_item(cart.pk, item.pk)
+        self.assertGreater(Cart.objects.get(pk=cart.pk).updated_at, idle)
+
+    def test_add_to_a_purged_cart_is_not_found(self):
+        store = DatabaseCartStore()
+        cart = idle_cart(8)
+        self.assertEqual(purge_expired_carts(), 1)
+        with self.assertRaises(CartNotFound):
+            store.add_item(cart.pk, self.product.pk, 1)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_purged_carts_are_exported(self):
+        before = int(next(carts_purged.samples()).split()[-1])
+        idle_cart(8)
+        idle_cart(9)
+        purge_expired_carts()
+        self.assertIn(f'store_carts_purged_total {before + 2}\n', registry.render())
+
+
+@skipUnlessDBFeature('has_select_for_update_skip_locked')
+class CartPurgeLockTests(TransactionTestCase):
+    def test_skips_carts_locked_by_a_checkout(self):
+        locked, unlocked = idle_cart(8), idle_cart(9)
+        with transaction.atomic():
+            Cart.objects.select_for_update().get(pk=locked.pk)
+            purged = run_concurrently(lambda index: purge_expired_carts(), 1)
+        self.assertEqual(purged, [1])
+        self.assertQuerysetEqual(Cart.objects.all(), [locked])
+        self.assertFalse(Cart.objects.filter(pk=unlocked.pk).exists())
+
+
+# SQLite locks the whole database, so there is no row-level race to lose.
+@skipUnlessDBFeature('has_select_for_update')
+class CartPurgeRaceTests(TransactionTestCase):
+    adders = 5
+
+    def setUp(self):
+        category = Category.objects.create(title='Shoes')
+        self.product = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=self.adders, category=category)
+
+    def test_adds_racing_the_purge_succeed_or_find_no_cart(self):
+        store = DatabaseCartStore()
+        for attempt in range(5):
+            cart = idle_cart(8)
+
+            def run(index):
+                if index == self.adders:
+                    return purge_expired_carts()
+                return store.add_item(cart.pk, self.product.pk, 1)
+
+            with self.subTest(attempt=attempt):
+                *added, purged = run_concurrently(run, self.adders + 1)
+                for result in added:
+                    self.assertIsInstance(result, (CartItem, CartNotFound))
+                # An add marks the cart active, so the purge either ran
+                # before every add or deleted nothing.
+                succeeded = sum(isinstance(result, CartItem) for result in added)
+                self.assertEqual(purged, 0 if succeeded else 1)
+                items = CartItem.objects.filter(cart_id=cart.pk)
+                self.assertEqual(sum(items.values_list('quantity', flat=True)), succeeded)
+                Cart.objects.all().delete()
+
+
+@mock.patch('store.carts.time.monotonic', return_value=1000.0)
+class InMemoryRedisTests(SimpleTestCase):
+    def test_expire_needs_an_existing_key(self, monotonic):
+        client = InMemoryRedis()
+        self.assertFalse(client.expire('cart:1', 10))
+        client.hset('cart:1', 'a', 1)
+        self.assertTrue(client.expire('cart:1', 10))
+
+    def test_keys_expire_lazily(self, monotonic):
+        client = InMemoryRedis()
+        client.hset('cart:1', 'a', 1)
+        client.expire('cart:1', 10)
+        monotonic.return_value += 9
+        self.assertEqual(client.hgetall('cart:1'), {'a': '1'})
+        monotonic.return_value += 1
+        self.assertEqual(client.hgetall('cart:1'), {})
+        self.assertEqual(client.exists('cart:1'), 0)
+
+    def test_expire_again_extends_the_deadline(self, monotonic):
+        client = InMemoryRedis()
+        client.hset('cart:1', 'a', 1)
+        client.expire('cart:1', 10)
+        monotonic.return_value += 9
+        client.expire('cart:1', 10)
+        monotonic.return_value += 9
+        self.assertEqual(client.exists('cart:1'), 1)
+
+    def test_writes_after_expiry_start_a_new_key(self, monotonic):
+        client = InMemoryRedis()
+        client.hset('cart:1', 'a', 1)
+        client.expire('cart:1', 10)
+        monotonic.return_value += 10
+        client.hincrby('cart:1', 'b', 2)
+        self.assertEqual(client.hgetall('cart:1'), {'b': '2'})
+        self.assertFalse(client.expire('cart:2', 10))
+
+
+@mock.patch('store.carts.time.monotonic', return_value=1000.0)
+class RedisCartExpiryTests(TestCase):
+    def test_item_activity_restarts_the_clock(self, monotonic):
+        category = Category.objects.create(title='Shoes')
+        product = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=10, category=category)
+        store = InMemoryCartStore()
+        cart = store.create()
+        ttl = settings.STORE_CART_TTL
+
+        monotonic.return_value += ttl - 1
+        store.add_item(cart.pk, product.pk, 1)
+        monotonic.return_value += ttl - 1
+        self.assertTrue(store.exists(cart.pk))
+        monotonic.return_value += 1
+        self.assertFalse(store.exists(cart.pk))
+
+
+def titles_of_items(cart):
+    return [item['product']['title'] for item in cart['items']]
+
+
+class CartStoreTests:
+    """The cart API behaves the same with every cart store."""
+    backend = None
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Shoes')
+        cls.shoe = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=5, category=category)
+        cls.lace = Product.objects.create(
+            title='Lace', unit_price='2.50', inventory=5, category=category)
+
+    def setUp(self):
+        backend = override_settings(STORE_CART_BACKEND=self.backend)
+        backend.enable()
+        self.addCleanup(backend.disable)
+        stores = mock.patch.dict('store.carts._stores', clear=True)
+        stores.start()
+        self.addCleanup(stores.stop)
+        self.cart_id = self.client.post('/store/carts/').json()['id']
+        self.items_url = f'/store/carts/{self.cart_id}/items/'
+
+    def add(self, product, quantity):
+        response = self.client.post(
+            self.items_url, {'product_id': product.pk, 'quantity': quantity})
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()['id']
+
+    def patch(self, item_id, quantity):
+        return self.client.patch(
+            f'{self.items_url}{item_id}/', {'quantity': quantity},
+            content_type='application/json')
+
+    def cart(self):
+        return self.client.get(f'/store/carts/{self.cart_id}/')
+
+    def test_item_lifecycle(self):
+        shoe = self.add(self.shoe, 2)
+        lace = self.add(self.lace, 4)
+        self.assertEqual(self.cart().json()['total_price'], 30)
+
+        response = self.patch(shoe, 3)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'quantity': 3})
+        item = self.client.get(f'{self.items_url}{shoe}/').json()
+        self.assertEqual((item['quantity'], item['total_price']), (3, 30))
+        self.assertEqual(self.patch(shoe + lace + 100, 1).status_code, 404)
+
+        self.assertEqual(self.client.delete(f'{self.items_url}{lace}/').status_code, 204)
+        self.assertEqual(self.client.delete(f'{self.items_url}{lace}/').status_code, 404)
+        self.assertEqual(titles_of_items(self.cart().json()), ['Red Shoe'])
+
+        self.assertEqual(self.client.delete(f'/store/carts/{self.cart_id}/').status_code, 204)
+        self.assertEqual(self.cart().status_code, 404)
+        self.assertEqual(self.client.post(self.items_url, {
+            'product_id': self.shoe.pk, 'quantity': 1}).status_code, 404)
+
+    def test_update_of_a_vanished_item_is_not_found(self):
+        item_id = self.add(self.shoe, 1)
+        store = import_string(self.backend)
+        with mock.patch.object(store, 'update_item', return_value=None):
+            self.assertEqual(self.patch(item_id, 2).status_code, 404)
+
+    def test_bulk_sets_quantities(self):
+        self.add(self.shoe, 1)
+        self.add(self.lace, 1)
+        response = self.client.post(f'{self.items_url}bulk/', [
+            {'product_id': self.shoe.pk, 'quantity': 0},
+            {'product_id': self.lace.pk, 'quantity': 2},
+            {'product_id': self.lace.pk, 'quantity': 3},
+            {'product_id': self.shoe.pk + self.lace.pk, 'quantity': 1},
+        ], content_type='application/json')
+        data = response.json()
+        self.assertEqual(titles_of_items(data), ['Lace'])
+        self.assertEqual(data['items'][0]['quantity'], 2)
+        self.assertEqual(data['total_price'], 5)
+        self.assertEqual([error['index'] for error in data['errors']], [2, 3])
+
+    def test_bulk_on_a_vanished_cart_is_not_found(self):
+        lines = [{'product_id': self.shoe.pk, 'quantity': 1}]
+        store = import_string(self.backend)
+        with mock.patch.object(store, 'get', return_value=None):
+            response = self.client.post(
+                f'{self.items_url}bulk/', lines, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+        self.client.delete(f'/store/carts/{self.cart_id}/')
+        response = self.client.post(
+            f'{self.items_url}bulk/', lines, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    @mock.patch('store.serializers.process_order_payment')
+    def test_checkout_writes_the_cart_through(self, process_order_payment):
+        self.add(self.shoe, 2)
+        self.add(self.lace, 1)
+        user = get_user_model().objects.create_user(
+            username='buyer', email='buyer@example.com', password='x',
+            address='Street 1', phone='+123456789')
+        serializer = CreateOrderSerializer(
+            data={'cart_id': self.cart_id}, context={'user': user})
+        serializer.is_valid(raise_exception=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            order = serializer.save()
+        self.assertEqual(order.total_amount, Decimal('22.50'))
+        self.assertEqual(dict(order.items.values_list('product_id', 'quantity')),
+                         {self.shoe.pk: 2, self.lace.pk: 1})
+        self.assertEqual(self.cart().status_code, 404)
+        self.assertFalse(Cart.objects.exists())
+
+
+class DatabaseCartStoreTests(CartStoreTests, TestCase):
+    backend = 'store.carts.DatabaseCartStore'
+
+
+class InMemoryCartStoreTests(CartStoreTests, TestCase):
+    backend = 'store.carts.InMemoryCartStore'
+
+
+REPLICA = 'replica_test'
+REPLICA_MODELS = [Category, Product, ProductImage]
+
+
+@skipUnless(connection.vendor == 'sqlite', 'The replica is a second SQLite database.')
+class ReplicaTests(TransactionTestCase):
+    """
+    A primary and a lagging replica: the replica is a second, in-memory
+    SQLite database seeded through ``using()`` with older titles.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Added after the test case set up its databases, so the test
+        # runner neither creates nor guards it.
+        connections.settings[REPLICA] = dict(
+            connections.settings['default'], NAME=':memory:')
+        # A fresh ReplicaRouter sees the new alias.
+        cls.routers = override_settings(DATABASE_ROUTERS=settings.DATABASE_ROUTERS)
+        cls.routers.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.routers.disable()
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        super().tearDownClass()
+
+    def setUp(self):
+        with connections[REPLICA].schema_editor() as editor:
+            for model in REPLICA_MODELS:
+                editor.create_model(model)
+        self.category = Category.objects.create(title='Shoes')
+        self.product = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=10, category=self.category)
+        Category.objects.using(REPLICA).create(pk=self.category.pk, title='Old shoes')
+        Product.objects.using(REPLICA).create(
+            pk=self.product.pk, title='Old shoe', unit_price=10, inventory=10,
+            category_id=self.category.pk)
+        # Seeding is not a catalog write the replicas lag behind.
+        get_catalog_cache().clear()
+
+    def tearDown(self):
+        with connections[REPLICA].schema_editor() as editor:
+            for model in reversed(REPLICA_MODELS):
+                editor.delete_model(model)
+
+    def test_router_sends_opted_in_reads_to_the_replica(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Product))
+        token = reading_replica.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Product), REPLICA)
+            self.assertEqual(router.db_for_write(Product), 'default')
+        finally:
+            reading_replica.reset(token)
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        client = Client()
+        self.assertEqual(titles(client.get('/store/category/')), ['Old shoes'])
+        self.assertEqual(client.post('/store/carts/').status_code, 201)
+        self.assertEqual(titles(client.get('/store/category/')), ['Shoes'])
+        self.assertEqual(titles(Client().get('/store/category/')), ['Old shoes'])
+
+    def test_catalog_reads_use_the_primary_after_a_catalog_write(self):
+        client = Client()
+        self.assertEqual(titles(client.get('/store/products/')), ['Old shoe'])
+        Product.objects.filter(pk=self.product.pk).update(title='New shoe')
+
+        # Not this client's write, yet filled from the primary and cached so.
+        response = client.get('/store/products/')
+        self.assertEqual(titles(response), ['New shoe'])
+        self.assertEqual(titles(client.get('/store/products/')), ['New shoe'])
+        self.assertEqual(client.get(f'/store/products/{self.product.pk}/').json()['title'],
+                         'New shoe')
+        self.assertEqual(client.get('/store/products/', HTTP_IF_NONE_MATCH=response['ETag'])
+                         .status_code, 304)
+
+        # Once the replicas have had time to catch up, they serve again.
+        get_catalog_cache().delete(CATALOG_SETTLING_KEY)
+        self.assertEqual(titles(client.get('/store/category/')), ['Old shoes'])
@@ -1,7 +1,7 @@
 from django.urls import path
 from django.urls.conf import include
 from rest_framework_nested import routers
-from . import views
+from . import async_views, views
 
 
 router = routers.DefaultRouter()
@@ -13,4 +13,18 @@ router.register('orders', views.OrderViewSet, basename='orders')
 carts_router = routers.NestedDefaultRouter(router, 'carts', lookup='cart')
 carts_router.register('items', views.CartItemViewSet, basename='cart-items')
 
-urlpatterns = router.urls + carts_router.urls
+async_urlpatterns = [
+    path('products/', async_views.ProductListView.as_view(),
+         name='async-products-list'),
+    path('products/<str:pk>/', async_views.ProductDetailView.as_view(),
+         name='async-products-detail'),
+    path('category/', async_views.CategoryListView.as_view(),
+         name='async-category-list'),
+    path('carts/<str:cart_pk>/', async_views.CartDetailView.as_view(),
+         name='async-carts-detail'),
+    path('carts/<str:cart_pk>/items/', async_views.CartItemListView.as_view(),
+         name='async-cart-items-list'),
+]
+
+urlpatterns = [path('async/', include(async_urlpatterns))] + \
+    router.urls + carts_router.urls
@@ -1,58 +1,125 @@
-from django.db.models.aggregates import Count
+from django.db.models.deletion import ProtectedError
+from django.http import Http404
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework import status
-from rest_framework.mixins import CreateModelMixin, DestroyModelMixin, RetrieveModelMixin
 from .models import Category, Product, Cart, CartItem, Order
-from .serializers import CategorySerializer, ProductSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, OrderSerializer, CreateOrderSerializer, UpdateOrderSerializer
+from .serializers import CategorySerializer, ProductSerializer, ProductRowSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer, BulkCartItemSerializer, UpdateCartItemSerializer, OrderSerializer, OrderSummarySerializer, CreateOrderSerializer, UpdateOrderSerializer
 from .permissions import IsAdminOrReadOnly
-from .filters import ProductFilter
-from .pagination import DefaultPagination
-from django.contrib.auth import get_user_model
+from .filters import ProductFilter, FullTextSearchFilter, OrderExportFilter
+from .pagination import DefaultPagination, KeysetPaginationMixin, ProductKeysetPagination, OrderKeysetPagination
+from .cache import CatalogCacheMixin, ConditionalGetMixin, product_slugs
+from .carts import CartNotFound, get_cart_store
+from .streaming import StreamingListMixin, streaming_response
+from .exports import CONTENT_TYPES, EXPORTERS, export_orders
 
 
-class CategoryViewSet(ModelViewSet):
-    queryset = Category.objects.annotate(
-        products_count=Count('products')).all()
+class CategoryViewSet(ConditionalGetMixin, ModelViewSet):
+    queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
+    replica_actions = ['list', 'retrieve']
 
     def destroy(self, request, *args, **kwargs):
-        if Product.objects.filter(category_id=kwargs['pk']):
-            return Response({'error': 'Category cannot be deleted because it includes one or more products.'},
-                            status=status.HTTP_405_METHOD_NOT_ALLOWED)
+        category = self.get_object()
+        if category.products_count == 0:
+            try:
+                self.perform_destroy(category)
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            except ProtectedError:
+                # products_count lagged behind; the PROTECT foreign key still holds.
+                pass
 
-        return super().destroy(request, *args, **kwargs)
+        return Response({'error': 'Category cannot be deleted because it includes one or more products.'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, CatalogCacheMixin, StreamingListMixin, KeysetPaginationMixin, ModelViewSet):
     queryset = Product.objects.select_related(
         'category').prefetch_related('images').all()
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend,
+                       FullTextSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
     pagination_class = DefaultPagination
+    keyset_pagination_class = ProductKeysetPagination
     permission_classes = [IsAdminOrReadOnly]
     search_fields = ['title', 'description']
     ordering_fields = ['unit_price']
+    cache_prefix = 'products'
+    replica_actions = ['list', 'retrieve', 'by_slug']
 
+    @action(detail=False, url_path=r'by-slug/(?P<slug>[-\w]+)')
+    def by_slug(self, request, *args, **kwargs):
+        return self.cached_response(self.retrieve_by_slug, request, *args, **kwargs)
 
-class CartViewSet(CreateModelMixin,
-                  RetrieveModelMixin,
-                  DestroyModelMixin,
-                  GenericViewSet):
-    queryset = Cart.objects.prefetch_related('items__product').all()
+    def retrieve_by_slug(self, request, *args, **kwargs):
+        slug = self.kwargs['slug']
+        queryset = self.get_queryset()
+        product_id = product_slugs.get(slug)
+        product = queryset.filter(pk=product_id).first() \
+            if product_id is not None else None
+        # The cached id may be stale if another process re-slugged it.
+        if product is None or product.slug != slug:
+            product_slugs.delete(slug)
+            product = get_object_or_404(queryset, slug=slug)
+            product_slugs.set(slug, product.pk)
+        return Response(self.get_serializer(product).data)
+
+    def serves_rows(self):
+        return self.action == 'list' and self.request.method in ('GET', 'HEAD')
+
+    def get_queryset(self):
+        if self.serves_rows():
+            return Product.objects.values(*ProductRowSerializer.values_fields)
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.serves_rows():
+            return ProductRowSerializer
+        return ProductSerializer
+
+
+class CartViewSet(GenericViewSet):
+    # Carts are read and written through the configured cart store;
+    # the queryset only names the router basename.
+    queryset = Cart.objects.none()
     serializer_class = CartSerializer
+    filter_backends = []
+
+    def create(self, request, *args, **kwargs):
+        cart = get_cart_store().create()
+        serializer = self.get_serializer(cart)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def retrieve(self, request, *args, **kwargs):
+        cart = get_cart_store().get(kwargs['pk'])
+        if cart is None:
+            raise Http404
+        serializer = self.get_serializer(cart)
+        return Response(serializer.data)
+
+    def destroy(self, request, *args, **kwargs):
+        if not get_cart_store().delete(kwargs['pk']):
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-class CartItemViewSet(ModelViewSet):
+
+class CartItemViewSet(GenericViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
+    queryset = CartItem.objects.none()
+    filter_backends = []
 
     def get_serializer_class(self):
-        if self.request.method == 'POST':
+        if self.action == 'bulk':
+            return BulkCartItemSerializer
+        elif self.request.method == 'POST':
             return AddCartItemSerializer
         elif self.request.method == 'PATCH':
             return UpdateCartItemSerializer
@@ -61,24 +128,107 @@ class CartItemViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'cart_id': self.kwargs['cart_pk']}
 
-    def get_queryset(self):
-        return CartItem.objects \
-            .filter(cart_id=self.kwargs['cart_pk']) \
-            .select_related('product')
+    def get_object(self):
+        item = get_cart_store().get_item(
+            self.kwargs['cart_pk'], self.kwargs['pk'])
+        if item is None:
+            raise Http404
+        return item
+
+    def list(self, request, *args, **kwargs):
+        items = get_cart_store().get_items(self.kwargs['cart_pk'])
+        serializer = self.get_serializer(items, many=True)
+        return Response(serializer.data)
 
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_object())
+        return Response(serializer.data)
 
-class OrderViewSet(ModelViewSet):
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def partial_update(self, request, *args, **kwargs):
+        serializer = self.get_serializer(
+            self.get_object(), data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
+    def destroy(self, request, *args, **kwargs):
+        if not get_cart_store().remove_item(
+                self.kwargs['cart_pk'], self.kwargs['pk']):
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        # Sets each line to the given quantity; 0 removes it.
+        quantities, indexes, errors = {}, {}, []
+        for index, line in enumerate(serializer.validated_data):
+            if line['product_id'] in quantities:
+                errors.append({'index': index, 'product_id': line['product_id'],
+                               'error': 'Duplicate product in request.'})
+            else:
+                quantities[line['product_id']] = line['quantity']
+                indexes[line['product_id']] = index
+
+        cart_store = get_cart_store()
+        try:
+            line_errors = cart_store.set_quantities(
+                self.kwargs['cart_pk'], quantities)
+        except CartNotFound:
+            raise Http404
+        errors += [{'index': indexes[product_id], 'product_id': product_id,
+                    'error': error}
+                   for product_id, error in line_errors.items()]
+
+        cart = cart_store.get(self.kwargs['cart_pk'])
+        if cart is None:
+            # Deleted or purged since the quantities were set.
+            raise Http404
+        data = CartSerializer(cart).data
+        data['errors'] = sorted(errors, key=lambda error: error['index'])
+        return Response(data)
+
+
+class OrderViewSet(StreamingListMixin, KeysetPaginationMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+    keyset_pagination_class = OrderKeysetPagination
+    replica_actions = ['list']
 
     def get_permissions(self):
-        if self.request.method in ['PATCH', 'DELETE']:
+        if self.request.method in ['PATCH', 'DELETE'] or self.action == 'export':
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
+    @action(detail=False, methods=['get'])
+    def export(self, request, *args, **kwargs):
+        # Not ``format``: DRF reserves it for content negotiation.
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in EXPORTERS:
+            raise ValidationError(
+                {'export_format': [f'Choose one of: {", ".join(EXPORTERS)}.']})
+        filterset = OrderExportFilter(request.query_params, Order.objects.all())
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+
+        response = streaming_response(
+            request._request, export_orders(filterset.qs, export_format),
+            content_type=CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = \
+            f'attachment; filename="orders.{export_format}"'
+        return response
+
     def create(self, request, *args, **kwargs):
         serializer = CreateOrderSerializer(
             data=request.data,
-            context={'id': self.request.user.id})
+            context={'user': self.request.user})
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
         serializer = OrderSerializer(order)
@@ -89,14 +239,21 @@ class OrderViewSet(ModelViewSet):
             return CreateOrderSerializer
         elif self.request.method == 'PATCH':
             return UpdateOrderSerializer
+        elif self.is_summary():
+            return OrderSummarySerializer
         return OrderSerializer
 
+    def is_summary(self):
+        return self.request.query_params.get('summary') in ('1', 'true')
+
     def get_queryset(self):
         user = self.request.user
 
         if user.is_staff:
-            return Order.objects.all().prefetch_related('items__product')
+            queryset = Order.objects.all()
+        else:
+            queryset = Order.objects.filter(customer_id=user.id)
 
-        customer_id = get_user_model().objects.only(
-            'id').get(id=user.id)
-        return Order.objects.filter(customer_id=customer_id).prefetch_related('items__product')
+        if self.is_summary():
+            return queryset
+        return queryset.prefetch_related('items__product')
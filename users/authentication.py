@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+# Copied onto the token so requests never load the user row. The payload
+# is signed, not encrypted: whoever holds the token can read these.
+CLAIMS = ['username', 'is_staff', 'is_superuser', 'address', 'phone']
+# What checkout validates; a missing claim means "ask the DB".
+PROFILE_CLAIMS = ['address', 'phone']
+# A change to any of these revokes tokens issued before it.
+STATE_FIELDS = ['is_active', 'is_staff', 'is_superuser', 'password']
+
+
+def get_state_cache():
+    return caches[settings.USERS_TOKEN_STATE_CACHE]
+
+
+def state_key(user_id):
+    return f'users:token-state:{user_id}'
+
+
+def auth_hash(user):
+    # Not the session auth hash, which the readable payload would expose.
+    key_salt = 'users.authentication.auth_hash'
+    return salted_hmac(key_salt, user.password, algorithm='sha256').hexdigest()
+
+
+def get_token_state(user_id):
+    """
+    The fields a token is checked against, and the current profile
+    claims, cached for USERS_TOKEN_STATE_TTL seconds. ``False`` for a
+    missing user.
+    """
+    cache = get_state_cache()
+    key = state_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        user = get_user_model().objects \
+            .only(*STATE_FIELDS, *PROFILE_CLAIMS) \
+            .filter(pk=user_id) \
+            .first()
+        state = False if user is None else {
+            'is_active': user.is_active,
+            'is_staff': user.is_staff,
+            'is_superuser': user.is_superuser,
+            'auth_hash': auth_hash(user),
+            'profile': {claim: getattr(user, claim) for claim in PROFILE_CLAIMS},
+        }
+        cache.set(key, state, settings.USERS_TOKEN_STATE_TTL)
+    return state
+
+
+def forget_token_state(user_id):
+    get_state_cache().delete(state_key(user_id))
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        for claim in CLAIMS:
+            token[claim] = getattr(user, claim)
+        token['auth_hash'] = auth_hash(user)
+        return token
+
+
+class TokenUserAuthentication(JWTStatelessUserAuthentication):
+    """
+    Authenticates as a TokenUser built from the token's claims. Tokens of
+    missing or inactive users, and tokens issued before a password or
+    staff status change, are rejected using the cached token state. When
+    the address or phone changed since the token was issued, those
+    claims are dropped so checkout loads them from the user row.
+    """
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        state = get_token_state(user.id)
+        if not state:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not state['is_active']:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if not constant_time_compare(validated_token.get('auth_hash', ''),
+                                     state['auth_hash']) or \
+                user.is_staff != state['is_staff'] or \
+                user.is_superuser != state['is_superuser']:
+            raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+        profile = state.get('profile', {})
+        if any(validated_token.get(claim) != value for claim, value in profile.items()):
+            for claim in PROFILE_CLAIMS:
+                setattr(user, claim, None)
+        return user
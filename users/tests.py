@@ -1,3 +1,114 @@
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from store.models import Cart, CartItem, Category, Product
+from .authentication import get_state_cache
 
-# Create your tests here.
+
+class TokenAuthenticationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username='buyer', email='buyer@example.com', password='secret-1',
+            address='Street 1', phone='+123456789')
+
+    def setUp(self):
+        get_state_cache().clear()
+        self.tokens = self.obtain()
+
+    def obtain(self, password='secret-1'):
+        response = self.client.post('/api/token/', {'username': 'buyer', 'password': password})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def detail(self, access=None):
+        # SessionAuthentication comes first and sends no challenge, so
+        # DRF answers failed token authentication with a 403.
+        response = self.get('/store/orders/', access)
+        return response.status_code, response.json().get('detail')
+
+    def get(self, path, access=None):
+        return self.client.get(
+            path, HTTP_AUTHORIZATION=f'Bearer {access or self.tokens["access"]}')
+
+    def update_user(self, **fields):
+        user = get_user_model().objects.get(pk=self.user.pk)
+        for name, value in fields.items():
+            setattr(user, name, value)
+        user.save()
+
+    def test_requests_do_not_load_the_user(self):
+        self.assertEqual(self.get('/store/orders/').status_code, 200)
+        # The cached token state, then the orders.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get('/store/orders/').status_code, 200)
+
+    def test_password_and_staff_changes_revoke_tokens(self):
+        for fields in [{'is_staff': True}, {'password': 'x'}]:
+            with self.subTest(**fields):
+                self.update_user(**fields)
+                self.assertEqual(self.detail(), (403, 'Token has been revoked'))
+                self.update_user(is_staff=False)
+
+    def test_inactive_and_deleted_users_are_rejected(self):
+        self.update_user(is_active=False)
+        self.assertEqual(self.detail(), (403, 'User is inactive'))
+        get_user_model().objects.filter(pk=self.user.pk).delete()
+        get_state_cache().clear()
+        self.assertEqual(self.detail(), (403, 'User not found'))
+
+    def test_refreshed_tokens_are_checked_too(self):
+        response = self.client.post('/api/token/refresh/', {'refresh': self.tokens['refresh']})
+        self.assertEqual(self.get('/store/orders/', response.json()['access']).status_code, 200)
+
+        self.user.set_password('secret-2')
+        self.user.save()
+        response = self.client.post('/api/token/refresh/', {'refresh': self.tokens['refresh']})
+        self.assertEqual(self.detail(response.json()['access']), (403, 'Token has been revoked'))
+        self.assertEqual(self.get('/store/orders/', self.obtain('secret-2')['access']).status_code, 200)
+
+    def test_auth_hash_is_not_the_session_hash(self):
+        payload = self.get('/users/me/').wsgi_request.auth.payload
+        self.assertNotEqual(payload['auth_hash'], self.user.get_session_auth_hash())
+
+
+@mock.patch('store.serializers.process_order_payment')
+class TokenCheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username='buyer', email='buyer@example.com', password='secret-1',
+            address='Street 1', phone='+123456789')
+        category = Category.objects.create(title='Shoes')
+        cls.product = Product.objects.create(
+            title='Red Shoe', unit_price=10, inventory=10, category=category)
+
+    def setUp(self):
+        get_state_cache().clear()
+        response = self.client.post('/api/token/', {'username': 'buyer', 'password': 'secret-1'})
+        self.access = response.json()['access']
+
+    def checkout(self):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        return self.client.post('/store/orders/', {'cart_id': cart.pk},
+                                HTTP_AUTHORIZATION=f'Bearer {self.access}')
+
+    def test_checkout_trusts_unchanged_claims(self, process_order_payment):
+        self.checkout()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.checkout().status_code, 200)
+        user_table = get_user_model()._meta.db_table
+        self.assertFalse([query['sql'] for query in queries if user_table in query['sql']])
+
+    def test_checkout_reloads_a_changed_profile(self, process_order_payment):
+        response = self.client.patch(
+            '/users/me/', {'address': None}, content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.checkout()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), ['Your address should not be empty'])
@@ -1,3 +1,4 @@
+from django.contrib.auth import get_user_model
 from rest_framework import generics
 from .serializers import UserSerializer
 from django.contrib.auth.password_validation import validate_password
@@ -20,4 +21,5 @@ class ProfileView(generics.RetrieveUpdateAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        # Token-authenticated requests carry a TokenUser, not the row.
+        return get_user_model().objects.get(pk=self.request.user.pk)